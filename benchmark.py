@@ -0,0 +1,409 @@
+# Offline benchmark of the bot's handlers.
+#
+# Drives the real handlers through an Application with synthetic updates, a
+# Bot that records API calls instead of sending them, and a generated items.db:
+#
+#     python benchmark.py --rows 1000 100000 --updates 500 --output bench_results.json
+#     python benchmark.py --rows 100000 --baseline bench_results.json
+#
+# Reports p50/p99 latency, SQL statements and Bot API calls per update for every
+# scenario and writes the numbers as JSON, --baseline compares against such a file.
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import warnings
+
+from telegram import Update
+from telegram.ext import Application, ExtBot
+from telegram.warnings import PTBUserWarning
+
+import bot
+import bulk
+import callbacks
+import catalog
+import prefixindex
+import storage
+from persistence import SQLitePersistence
+
+WORDS = ['phone', 'laptop', 'shirt', 'coffee', 'novel', 'chair', 'lamp', 'camera', 'jacket', 'table',
+         'tea', 'guitar', 'watch', 'shoes', 'desk', 'speaker', 'bread', 'honey', 'pencil', 'bag']
+SEARCH_TERMS = ['phone', 'lap', 'coffee table', 'red', 'gui', 'product 0001', 'labtop', 'cofee tabel']
+ADMIN_ID = bot.ADMIN_IDS[0]
+# Products in the CSV the import scenario uploads
+IMPORT_ROWS = 100
+# Increase reported as a regression against the baseline; latencies must also
+# grow by REGRESSION_MIN_MS, sub-millisecond timings are too noisy otherwise
+REGRESSION_THRESHOLD = 0.2
+REGRESSION_MIN_MS = 0.5
+
+
+# Counts SQL statements run on the storage connections; trigger bodies, transaction
+# control (including the savepoints of grouped writes) and pragmas excluded
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, statement):
+        head = statement.lstrip()[:9].upper()
+        if head.startswith(('--', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA')):
+            return
+        with self._lock:
+            self.count += 1
+
+    def install(self):
+        connect = storage._connect
+
+        def traced_connect(read_only=False):
+            conn = connect(read_only)
+            conn.set_trace_callback(self)
+            return conn
+
+        storage._connect = traced_connect
+
+
+# Bot that answers every API call locally and counts them
+class RecordingBot(ExtBot):
+    def __init__(self, document_path=None):
+        super().__init__('123456:bench')
+        # Bot objects are frozen, so the counters live in a mutable dict
+        with self._unfrozen():
+            self.api_calls = collections.Counter()
+            self._message_ids = iter(range(1, 1 << 62))
+            # Every uploaded document is "downloaded" from this local file
+            self.document_path = document_path
+
+    async def _do_post(self, endpoint, data, **kwargs):
+        self.api_calls[endpoint] += 1
+        if endpoint == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if endpoint == 'getFile':
+            # A local path, which File.download_to_drive copies instead of fetching
+            return {'file_id': data['file_id'], 'file_unique_id': data['file_id'], 'file_path': self.document_path}
+        if endpoint in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendDocument'):
+            return {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': data.get('chat_id', 1), 'type': 'private'},
+                'text': data.get('text', ''),
+            }
+        return True
+
+
+# Synthetic updates, one user per chat like private conversations
+class UpdateFactory:
+    def __init__(self, bot_instance):
+        self.bot = bot_instance
+        self.update_ids = iter(range(1, 1 << 62))
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+    def message(self, user_id, text):
+        update_id = next(self.update_ids)
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': update_id, 'message': message}, self.bot)
+
+    def document(self, user_id, file_name):
+        update_id = next(self.update_ids)
+        return Update.de_json({'update_id': update_id, 'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'document': {'file_id': f'doc{update_id}', 'file_unique_id': f'doc{update_id}', 'file_name': file_name},
+        }}, self.bot)
+
+    def callback(self, user_id, data):
+        update_id = next(self.update_ids)
+        return Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': 123456, 'is_bot': True, 'first_name': 'Bench'},
+                    'text': 'previous screen',
+                },
+            },
+        }, self.bot)
+
+    def inline_query(self, user_id, query, offset=''):
+        update_id = next(self.update_ids)
+        return Update.de_json({
+            'update_id': update_id,
+            'inline_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'query': query,
+                'offset': offset,
+            },
+        }, self.bot)
+
+
+# Generated catalog of `rows` products, built once and reused by later runs
+async def generate_catalog(rows, seed, db_dir):
+    path = os.path.join(db_dir, f'bench_items_{rows}.db')
+    if os.path.exists(path):
+        return path
+
+    building = path + '.building'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(building + suffix):
+            os.remove(building + suffix)
+    storage.DB_PATH = building
+    storage.init_db()
+    try:
+        rng = random.Random(seed)
+        categories = storage.DEFAULT_CATEGORIES + [f'Category {index}' for index in range(15)]
+        batch = []
+        for index in range(rows):
+            name = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} product {index:07d}"
+            batch.append((name, round(rng.uniform(1, 5000), 2), rng.choice(categories)))
+            if len(batch) == 50000:
+                await storage.upsert_items(batch)
+                batch = []
+        if batch:
+            await storage.upsert_items(batch)
+    finally:
+        # Closing the last connection checkpoints the WAL into the main file
+        storage.close_db()
+    os.replace(building, path)
+    return path
+
+
+# Scenario name -> function returning the updates of one iteration
+def build_scenarios(factory, rng, max_id, category_ids):
+    def customer():
+        return rng.randrange(10_000, 20_000)
+
+    def item_id():
+        return rng.randrange(1, max_id + 1)
+
+    def add_product():
+        return [
+            factory.callback(ADMIN_ID, 'add_item'),
+            factory.message(ADMIN_ID, f'Bench product {rng.random():.12f}'),
+            factory.message(ADMIN_ID, f'{rng.uniform(1, 5000):.2f}'),
+            factory.message(ADMIN_ID, '/skip'),
+            factory.callback(ADMIN_ID, callbacks.encode(callbacks.ADD_TO_CATEGORY, rng.choice(category_ids))),
+        ]
+
+    def edit_price():
+        return [
+            factory.callback(ADMIN_ID, callbacks.encode(callbacks.EDIT_PRODUCT, item_id())),
+            factory.callback(ADMIN_ID, callbacks.encode(callbacks.EDIT_FIELD, callbacks.FIELDS.index('price'))),
+            factory.message(ADMIN_ID, f'{rng.uniform(1, 5000):.2f}'),
+        ]
+
+    def search():
+        user = customer()
+        return [factory.callback(user, 'search'), factory.message(user, rng.choice(SEARCH_TERMS))]
+
+    # One keystroke of an inline query, the next page every fourth time
+    def inline_search():
+        term = rng.choice(SEARCH_TERMS)
+        query = term[:rng.randint(1, len(term))]
+        offset = str(bot.INLINE_PAGE_SIZE) if rng.random() < 0.25 else ''
+        return [factory.inline_query(customer(), query, offset)]
+
+    return {
+        'start': lambda: [factory.message(customer(), '/start')],
+        'browse_list': lambda: [factory.callback(customer(), 'list')],
+        'browse_page': lambda: [
+            factory.callback(customer(), callbacks.encode(callbacks.LIST_PAGE, callbacks.NEXT, item_id()))
+        ],
+        'sort_page': lambda: [
+            factory.callback(customer(), callbacks.encode(callbacks.SORT_PAGE, callbacks.NEXT, item_id()))
+        ],
+        'price_page': lambda: [factory.callback(customer(), callbacks.encode(
+            callbacks.PRICE_PAGE, callbacks.NEXT, item_id(),
+            *callbacks.PriceView(rng.choice(callbacks.PRICE_ORDERS), rng.choice([None, 0, 1]), rng.choice(category_ids)).args()
+        ))],
+        'filter_categories': lambda: [factory.callback(customer(), 'filter')],
+        'category': lambda: [
+            factory.callback(customer(), callbacks.encode(callbacks.CATEGORY, rng.choice(category_ids)))
+        ],
+        'search': search,
+        'inline_search': inline_search,
+        'admin_panel': lambda: [factory.message(ADMIN_ID, '/admin')],
+        'stats': lambda: [factory.message(ADMIN_ID, '/stats')],
+        'add_product': add_product,
+        'edit_price': edit_price,
+        'import': lambda: [factory.message(ADMIN_ID, '/import'), factory.document(ADMIN_ID, 'products.csv')],
+        'export': lambda: [factory.message(ADMIN_ID, f'/export {rng.choice(bulk.EXPORT_FORMATS)}')],
+    }
+
+
+# CSV the import scenario uploads, the same products every time so repeated
+# imports update them instead of growing the catalog
+def write_import_file(path, rows=IMPORT_ROWS):
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        out.write('name,price,category\n')
+        out.writelines(f'Imported product {index:04d},{index + 1}.50,Books\n' for index in range(rows))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# A handler error fails the run, Application.process_update would only log it
+async def run_scenario(app, counter, make_updates, iterations, cold):
+    latencies = []
+    queries = api_calls = 0
+    for _ in range(iterations):
+        for update in make_updates():
+            if cold:
+                catalog.invalidate(categories=True)
+            queries_before, calls_before = counter.count, app.bot.api_calls.total()
+            started = time.perf_counter()
+            await app.process_update(update)
+            latencies.append(time.perf_counter() - started)
+            if app.bot_data.get('errors'):
+                raise RuntimeError(f"handler failed on {update.to_dict()}") from app.bot_data['errors'][0]
+            queries += counter.count - queries_before
+            api_calls += app.bot.api_calls.total() - calls_before
+
+    updates = len(latencies)
+    return {
+        'updates': updates,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'queries_per_update': round(queries / updates, 2),
+        'api_calls_per_update': round(api_calls / updates, 2),
+    }
+
+
+async def benchmark_size(rows, args, counter):
+    # Scenarios write to the catalog, so every run starts from a copy of the generated one
+    template = await generate_catalog(rows, args.seed, args.db_dir)
+    storage.DB_PATH = os.path.join(args.db_dir, f'bench_items_{rows}.run.db')
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(storage.DB_PATH + suffix):
+            os.remove(storage.DB_PATH + suffix)
+    shutil.copyfile(template, storage.DB_PATH)
+
+    storage.init_db()
+    catalog.invalidate(categories=True)
+    prefixindex.reset()
+    try:
+        category_ids = [category_id for category_id, _ in await storage.get_category_rows()]
+
+        persistence = SQLitePersistence(update_interval=3600)
+        import_path = os.path.join(args.db_dir, 'bench_import.csv')
+        write_import_file(import_path)
+        app = Application.builder().bot(RecordingBot(import_path)).persistence(persistence).build()
+        bot.add_handlers(app)
+
+        async def record_error(update, context):
+            context.bot_data.setdefault('errors', []).append(context.error)
+
+        app.add_error_handler(record_error)
+        await app.initialize()
+        try:
+            rng = random.Random(args.seed)
+            scenarios = build_scenarios(UpdateFactory(app.bot), rng, max(rows, 1), category_ids)
+            selected = args.scenario or list(scenarios)
+            results = {}
+            for name in selected:
+                # Warm up connections and code paths before measuring
+                await run_scenario(app, counter, scenarios[name], min(10, args.updates), args.cold)
+                results[name] = await run_scenario(app, counter, scenarios[name], args.updates, args.cold)
+                print_result(rows, name, results[name])
+            return results
+        finally:
+            await app.shutdown()
+    finally:
+        storage.close_db()
+
+
+def print_result(rows, name, result):
+    line = (f"{rows:>9} {name:<18} p50 {result['p50_ms']:>8.3f} ms  p99 {result['p99_ms']:>8.3f} ms  "
+            f"{result['queries_per_update']:>6.2f} queries  {result['api_calls_per_update']:>5.2f} api calls")
+    print(line, flush=True)
+
+
+# Print scenarios whose latency, queries or API calls grew past the threshold
+def compare(results, baseline):
+    regressions = []
+    for rows, scenarios in results.items():
+        for name, result in scenarios.items():
+            previous = baseline.get(rows, {}).get(name)
+            if previous is None:
+                continue
+            for metric in ('p50_ms', 'p99_ms', 'queries_per_update', 'api_calls_per_update'):
+                if metric.endswith('_ms') and result[metric] - previous[metric] < REGRESSION_MIN_MS:
+                    continue
+                if previous[metric] and result[metric] > previous[metric] * (1 + REGRESSION_THRESHOLD):
+                    regressions.append(f"{rows} {name} {metric}: {previous[metric]} -> {result[metric]}")
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return regressions
+
+
+async def main(args):
+    # The per_message hint of the conversation handlers, not useful here
+    warnings.filterwarnings('ignore', category=PTBUserWarning)
+    counter = QueryCounter()
+    counter.install()
+
+    results = {}
+    for rows in args.rows:
+        results[str(rows)] = await benchmark_size(rows, args, counter)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'updates_per_scenario': args.updates,
+        'cold_cache': args.cold,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        if compare(results, baseline):
+            return 1
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's handlers offline")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000], help="catalog sizes to benchmark")
+    parser.add_argument('--updates', type=int, default=200, help="iterations per scenario")
+    parser.add_argument('--scenario', action='append', help="only run this scenario, may repeat")
+    parser.add_argument('--cold', action='store_true', help="drop the catalog caches before every update")
+    parser.add_argument('--db-dir', default=tempfile.gettempdir(), help="where generated databases are kept")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json', help="JSON results file, empty to skip")
+    parser.add_argument('--baseline', help="earlier results file to compare against, exits 1 on regressions")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main(parse_args())))
@@ -1,114 +1,64 @@
+import asyncio
+import html
+import logging
+import math
 import os
-import sqlite3
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+import tempfile
+import time
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+
+import bulk
+import callbacks
+import catalog
+import metrics
+import notifications
+import prefixindex
+import startup
+import storage
+import views
+from navigation import show_screen, show_view
+from persistence import SQLitePersistence
+from processor import PerUserUpdateProcessor
+from router import CallbackRouter
+from ratelimit import GLOBAL_RATE, OutboundScheduler, PRIORITY_ADMIN
+from webhook import run_webhook
+from workers import WORKER_PROCESSES, run_workers
 
 # Replace with your admin IDs (can be one or multiple)
 ADMIN_IDS = [6363616486,1883435286]  # Add your admin IDs here
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# "polling" or "webhook", see webhook.py for the webhook settings
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Bot API server, the token is appended; point it at a local Bot API server or a stand-in
+BOT_API_URL = os.getenv("BOT_API_URL", "https://api.telegram.org/bot")
+BOT_API_FILE_URL = os.getenv("BOT_API_FILE_URL", "https://api.telegram.org/file/bot")
+# Minimum seconds between import progress messages
+IMPORT_PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", "2"))
+# Seconds Telegram may serve inline results from its own cache, and results per
+# inline page (Telegram accepts at most 50)
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+INLINE_PAGE_SIZE = min(int(os.getenv("INLINE_PAGE_SIZE", "20")), 50)
+
+logger = logging.getLogger(__name__)
 
 # Conversation states
 NAME, PRICE, CATEGORY = range(3)
 EDIT_ITEM, EDIT_FIELD, EDIT_VALUE = range(3, 6)
 ADD_CATEGORY = 6
-
-# Database setup
-def init_db():
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    
-    # Create items table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            price REAL NOT NULL,
-            category TEXT NOT NULL,
-            added_date TEXT NOT NULL
-        )
-    ''')
-    
-    # Create categories table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE
-        )
-    ''')
-    
-    # Insert default categories if they don't exist
-    default_categories = ['Electronics', 'Clothing', 'Food', 'Books', 'Furniture']
-    for category in default_categories:
-        try:
-            cursor.execute("INSERT OR IGNORE INTO categories (name) VALUES (?)", (category,))
-        except:
-            pass
-    
-    conn.commit()
-    conn.close()
+PHOTO = 7
 
 # Check if user is admin
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
-# Get all categories from database
-def get_categories():
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM categories ORDER BY name")
-    categories = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return categories
-
-# Add a new category to database
-def add_category(category_name):
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO categories (name) VALUES (?)", (category_name,))
-        conn.commit()
-        success = True
-    except sqlite3.IntegrityError:
-        success = False  # Category already exists
-    conn.close()
-    return success
-
 # Start command handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    welcome_text = """
-🛍️ *Welcome to Sami Shopping* 🛍️
-
-Browse products, compare prices, and find what you're looking for with ease!
-
-✨ *Features:*
-• 📋 Browse our complete product catalog
-• 🔍 Search for specific items
-• 🔠 Sort products alphabetically
-• 📂 Filter by category
+    screen = await views.welcome_screen(is_admin(update.effective_user.id))
 
-Use the menu below to start exploring! 👇
-    """
-    
-    # Add admin note if user is admin
-    if is_admin(update.effective_user.id):
-        welcome_text += "\n\n👑 *You have admin privileges!* Use /admin to access admin panel."
-    
-    keyboard = [
-        [InlineKeyboardButton("📋 Browse All Products", callback_data='list')],
-        [InlineKeyboardButton("🔍 Search Products", callback_data='search')],
-        [InlineKeyboardButton("🔠 Sort A-Z", callback_data='sort')],
-        [InlineKeyboardButton("📂 Filter by Category", callback_data='filter')]
-    ]
-    
-    # Add admin button if user is admin
-    if is_admin(update.effective_user.id):
-        keyboard.append([InlineKeyboardButton("👑 Admin Panel", callback_data='admin_panel')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     # Send as new message instead of editing
-    await update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=reply_markup)
+    await update.message.reply_text(screen.text, parse_mode=screen.parse_mode, reply_markup=screen.reply_markup)
     return ConversationHandler.END
 
 # Admin panel command
@@ -117,16 +67,9 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🚫 You are not authorized to use this command.")
         return
     
-    # If called from callback query
-    if update.callback_query:
-        query = update.callback_query
-        await query.answer()
-        chat_id = query.message.chat_id
-        message_id = query.message.message_id
-    else:
-        chat_id = update.message.chat_id
-        message_id = None
-        
+    # Set when opened from a button
+    query = update.callback_query
+
     admin_text = """
 🛠️ *Admin Panel* 🛠️
 
@@ -137,17 +80,11 @@ Welcome to the admin dashboard! Here's what you can do:
 • Delete products
 • Manage categories
 • View store statistics
+• Bulk import with /import, export with /export
     """
     
     # Get some stats for the admin
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM items")
-    total_items = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(DISTINCT category) FROM items")
-    total_categories = cursor.fetchone()[0]
-    conn.close()
+    total_items, total_categories = await storage.get_overview()
     
     admin_text += f"\n📊 *Current Stats:*\n• Total Products: {total_items}\n• Categories: {total_categories}"
     
@@ -163,25 +100,21 @@ Welcome to the admin dashboard! Here's what you can do:
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     if update.callback_query:
-        await context.bot.send_message(chat_id, admin_text, parse_mode='Markdown', reply_markup=reply_markup)
-        await context.bot.delete_message(chat_id, message_id)
+        await show_screen(query, context, admin_text, parse_mode='Markdown', reply_markup=reply_markup)
     else:
         await update.message.reply_text(admin_text, parse_mode='Markdown', reply_markup=reply_markup)
 
 # Start adding item process
 async def start_add_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     
-    await context.bot.send_message(
-        query.message.chat_id,
+    await show_screen(
+        query,
+        context,
         "➕ *Adding New Product*\n\nPlease enter the product name:",
         parse_mode='Markdown'
     )
     
-    # Delete the previous message
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
-    
     return NAME
 
 # Get product name
@@ -199,22 +132,13 @@ async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def get_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         price = float(update.message.text)
+        if not math.isfinite(price):
+            raise ValueError(price)
         context.user_data['item_price'] = price
         
-        # Show categories as buttons
-        categories = get_categories()
-        keyboard = []
-        for category in categories:
-            keyboard.append([InlineKeyboardButton(category, callback_data=f'cat_{category}')])
-        keyboard.append([InlineKeyboardButton("➕ Add New Category", callback_data='add_new_category')])
+        await update.message.reply_text("🖼 Send a photo of the product, or /skip to add it without one:")
         
-        await update.message.reply_text(
-            "📂 Please select a category or add a new one:",
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        
-        return CATEGORY
+        return PHOTO
     except ValueError:
         await update.message.reply_text(
             "❌ Invalid price format. Please enter a valid number:",
@@ -222,27 +146,56 @@ async def get_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return PRICE
 
+# Get product photo, or /skip. The photo is already on Telegram's servers, only
+# the file_id of its largest size is kept and every later send reuses it.
+async def get_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.photo:
+        context.user_data['item_photo'] = update.message.photo[-1].file_id
+    elif not update.message.text.startswith('/'):
+        await update.message.reply_text("❌ Please send a photo, or /skip to add the product without one:")
+        return PHOTO
+
+    # Show categories as buttons
+    categories = await catalog.get_category_rows()
+    keyboard = []
+    for category_id, category in categories:
+        keyboard.append([InlineKeyboardButton(
+            category, callback_data=callbacks.encode(callbacks.ADD_TO_CATEGORY, category_id))])
+    keyboard.append([InlineKeyboardButton("➕ Add New Category", callback_data='add_new_category')])
+    
+    await update.message.reply_text(
+        "📂 Please select a category or add a new one:",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    
+    return CATEGORY
+
 # Handle category selection
-async def handle_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# category_id is None for the "Add New Category" button
+async def handle_category(update: Update, context: ContextTypes.DEFAULT_TYPE, category_id=None):
     query = update.callback_query
-    await query.answer()
     
-    if query.data == 'add_new_category':
-        await context.bot.send_message(
-            query.message.chat_id,
+    if category_id is None:
+        await show_screen(
+            query,
+            context,
             "📂 Please enter the new category name:",
             parse_mode='Markdown'
         )
         return ADD_CATEGORY
     else:
-        category = query.data.replace('cat_', '')
+        category = await catalog.category_name(category_id)
+        if category is None:
+            await query.message.reply_text("❌ Category not found, please pick another one.")
+            return CATEGORY
         await save_product(context, category, query.message.chat_id)
         return ConversationHandler.END
 
 # Add new category
 async def add_new_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     category_name = update.message.text
-    success = add_category(category_name)
+    success = await catalog.add_category(category_name)
     
     if success:
         await save_product(context, category_name, update.message.chat_id)
@@ -252,10 +205,11 @@ async def add_new_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
         # Show categories again
-        categories = get_categories()
+        categories = await catalog.get_category_rows()
         keyboard = []
-        for category in categories:
-            keyboard.append([InlineKeyboardButton(category, callback_data=f'cat_{category}')])
+        for category_id, category in categories:
+            keyboard.append([InlineKeyboardButton(
+                category, callback_data=callbacks.encode(callbacks.ADD_TO_CATEGORY, category_id))])
         keyboard.append([InlineKeyboardButton("➕ Add New Category", callback_data='add_new_category')])
         
         await update.message.reply_text(
@@ -271,17 +225,10 @@ async def add_new_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def save_product(context, category, chat_id):
     name = context.user_data['item_name']
     price = context.user_data['item_price']
-    added_date = datetime.now().isoformat()
+    photo = context.user_data.get('item_photo')
 
     # Save to database
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO items (name, price, category, added_date) VALUES (?, ?, ?, ?)",
-        (name, price, category, added_date)
-    )
-    conn.commit()
-    conn.close()
+    await catalog.add_item(name, price, category, photo)
 
     # Clear user data
     context.user_data.clear()
@@ -293,138 +240,153 @@ async def save_product(context, category, chat_id):
     
     await context.bot.send_message(
         chat_id,
-        f"✅ *Product Added Successfully!*\n\n• Name: {name}\n• Price: {price:.2f} ETB\n• Category: {category}",
-        parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        f"✅ <b>Product Added Successfully!</b>\n\n• Name: {html.escape(name, quote=False)}\n• Price: {price:.2f} ETB"
+        f"\n• Category: {html.escape(category, quote=False)}\n• Photo: {'yes' if photo else 'none'}",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        rate_limit_args=PRIORITY_ADMIN
     )
 
-# Edit products - show list
-async def edit_items(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Edit products - show one page of the list
+async def edit_items(update: Update, context: ContextTypes.DEFAULT_TYPE, page=None):
     query = update.callback_query
-    await query.answer()
-    
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, price, category FROM items ORDER BY name")
-    items = cursor.fetchall()
-    conn.close()
+    after, before, _ = page or (None, None, None)
 
-    if not items:
+    page = await catalog.items_page('name', after=after, before=before)
+
+    if not page.items:
         keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data='admin_panel')]]
-        await context.bot.send_message(
-            query.message.chat_id,
+        await show_screen(
+            query,
+            context,
             "📭 No products available to edit.",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        await context.bot.delete_message(query.message.chat_id, query.message.message_id)
         return
 
-    response = "✏️ *Select a product to edit:*\n\n"
+    response = "✏️ <b>Select a product to edit:</b>\n\n"
     keyboard = []
     
-    for item in items:
-        response += f"• {item[1]} - {item[2]:.2f} ETB ({item[3]})\n"
+    for item in page.items:
+        response += f"• {html.escape(item[1], quote=False)} - {item[2]:.2f} ETB ({html.escape(item[3], quote=False)})\n"
         keyboard.append([InlineKeyboardButton(
-            f"✏️ {item[1]}", callback_data=f'edit_{item[0]}')])
+            f"✏️ {item[1]}", callback_data=callbacks.encode(callbacks.EDIT_PRODUCT, item[0]))])
     
+    keyboard += views.page_buttons(page, callbacks.EDIT_ITEMS_PAGE)
     keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data='admin_panel')])
     
-    await context.bot.send_message(
-        query.message.chat_id,
+    await show_screen(
+        query,
+        context,
         response,
-        parse_mode='Markdown',
+        parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
     
     return EDIT_ITEM
 
 # Edit a specific product
-async def edit_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_product(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id):
     query = update.callback_query
-    await query.answer()
     
-    product_id = query.data.replace('edit_', '')
     context.user_data['edit_product_id'] = product_id
     
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, price, category FROM items WHERE id = ?", (product_id,))
-    product = cursor.fetchone()
-    conn.close()
+    product = await storage.get_item(product_id)
     
     if not product:
         await query.message.reply_text("❌ Product not found.")
         return ConversationHandler.END
     
-    response = f"✏️ *Editing Product:*\n\n• Name: {product[0]}\n• Price: {product[1]:.2f} ETB\n• Category: {product[2]}\n\nSelect what you want to edit:"
+    response = (
+        f"✏️ <b>Editing Product:</b>\n\n• Name: {html.escape(product[0], quote=False)}\n• Price: {product[1]:.2f} ETB"
+        f"\n• Category: {html.escape(product[2], quote=False)}\n\nSelect what you want to edit:"
+    )
     
     keyboard = [
-        [InlineKeyboardButton("📝 Name", callback_data='edit_field_name')],
-        [InlineKeyboardButton("💰 Price", callback_data='edit_field_price')],
-        [InlineKeyboardButton("📂 Category", callback_data='edit_field_category')],
+        [InlineKeyboardButton("📝 Name", callback_data=callbacks.encode(callbacks.EDIT_FIELD, callbacks.FIELDS.index('name')))],
+        [InlineKeyboardButton("💰 Price", callback_data=callbacks.encode(callbacks.EDIT_FIELD, callbacks.FIELDS.index('price')))],
+        [InlineKeyboardButton("📂 Category", callback_data=callbacks.encode(callbacks.EDIT_FIELD, callbacks.FIELDS.index('category')))],
+        [InlineKeyboardButton("🖼 Photo", callback_data=callbacks.encode(callbacks.EDIT_FIELD, callbacks.FIELDS.index('photo_file_id')))],
         [InlineKeyboardButton("🔙 Back to Products", callback_data='edit_items')]
     ]
     
-    await context.bot.send_message(
-        query.message.chat_id,
+    await show_screen(
+        query,
+        context,
         response,
-        parse_mode='Markdown',
+        parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
     
     return EDIT_FIELD
 
 # Handle field selection for editing
-async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE, field):
     query = update.callback_query
-    await query.answer()
     
-    field = query.data.replace('edit_field_', '')
     context.user_data['edit_field'] = field
     
     if field == 'category':
         # Show categories as buttons
-        categories = get_categories()
+        categories = await catalog.get_category_rows()
         keyboard = []
-        for category in categories:
-            keyboard.append([InlineKeyboardButton(category, callback_data=f'edit_cat_{category}')])
+        for category_id, category in categories:
+            keyboard.append([InlineKeyboardButton(
+                category, callback_data=callbacks.encode(callbacks.EDIT_CATEGORY, category_id))])
         
-        await context.bot.send_message(
-            query.message.chat_id,
+        await show_screen(
+            query,
+            context,
             "📂 Select a new category:",
             parse_mode='Markdown',
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
         return EDIT_VALUE
+    elif field == 'photo_file_id':
+        await show_screen(query, context, "🖼 Send the new photo, or /skip to remove the current one:")
+        return EDIT_VALUE
     else:
         field_name = "name" if field == "name" else "price"
-        await context.bot.send_message(
-            query.message.chat_id,
+        await show_screen(
+            query,
+            context,
             f"📝 Enter the new {field_name}:",
             parse_mode='Markdown'
         )
-        await context.bot.delete_message(query.message.chat_id, query.message.message_id)
         return EDIT_VALUE
 
 # Handle category selection for editing
-async def edit_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_category(update: Update, context: ContextTypes.DEFAULT_TYPE, category_id):
     query = update.callback_query
-    await query.answer()
     
-    new_value = query.data.replace('edit_cat_', '')
+    new_value = await catalog.category_name(category_id)
+    if new_value is None:
+        await query.message.reply_text("❌ Category not found, please pick another one.")
+        return EDIT_VALUE
     await update_product_field(context, new_value, query.message.chat_id)
     return ConversationHandler.END
 
-# Handle text input for editing
+# Handle text or photo input for editing, /skip removes the photo
 async def edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_value = update.message.text
     field = context.user_data['edit_field']
     
-    if field == 'price':
+    if field == 'photo_file_id':
+        if update.message.photo:
+            new_value = update.message.photo[-1].file_id
+        elif new_value.startswith('/'):
+            new_value = None
+        else:
+            await update.message.reply_text("❌ Please send a photo, or /skip to remove the current one:")
+            return EDIT_VALUE
+    elif new_value is None or new_value.startswith('/'):
+        await update.message.reply_text(f"❌ Please enter the new {field}:")
+        return EDIT_VALUE
+    elif field == 'price':
         try:
             new_value = float(new_value)
+            if not math.isfinite(new_value):
+                raise ValueError(new_value)
         except ValueError:
             await update.message.reply_text(
                 "❌ Invalid price format. Please enter a valid number:",
@@ -440,18 +402,7 @@ async def update_product_field(context, new_value, chat_id):
     product_id = context.user_data['edit_product_id']
     field = context.user_data['edit_field']
     
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    
-    if field == 'name':
-        cursor.execute("UPDATE items SET name = ? WHERE id = ?", (new_value, product_id))
-    elif field == 'price':
-        cursor.execute("UPDATE items SET price = ? WHERE id = ?", (new_value, product_id))
-    elif field == 'category':
-        cursor.execute("UPDATE items SET category = ? WHERE id = ?", (new_value, product_id))
-    
-    conn.commit()
-    conn.close()
+    await catalog.update_item_field(product_id, field, new_value)
     
     # Clear user data
     context.user_data.clear()
@@ -465,176 +416,264 @@ async def update_product_field(context, new_value, chat_id):
         chat_id,
         f"✅ Product updated successfully!",
         parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        rate_limit_args=PRIORITY_ADMIN
     )
 
-# Delete products - show list
-async def delete_items(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Delete products - show one page of the list
+async def delete_items(update: Update, context: ContextTypes.DEFAULT_TYPE, page=None):
     query = update.callback_query
-    await query.answer()
-    
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, price, category FROM items ORDER BY name")
-    items = cursor.fetchall()
-    conn.close()
+    after, before, _ = page or (None, None, None)
 
-    if not items:
+    page = await catalog.items_page('name', after=after, before=before)
+
+    if not page.items:
         keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data='admin_panel')]]
-        await context.bot.send_message(
-            query.message.chat_id,
+        await show_screen(
+            query,
+            context,
             "📭 No products available to delete.",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        await context.bot.delete_message(query.message.chat_id, query.message.message_id)
         return
 
-    response = "🗑️ *Select a product to delete:*\n\n"
+    response = "🗑️ <b>Select a product to delete:</b>\n\n"
     keyboard = []
     
-    for item in items:
-        response += f"• {item[1]} - {item[2]:.2f} ETB ({item[3]})\n"
+    for item in page.items:
+        response += f"• {html.escape(item[1], quote=False)} - {item[2]:.2f} ETB ({html.escape(item[3], quote=False)})\n"
         keyboard.append([InlineKeyboardButton(
-            f"🗑️ {item[1]}", callback_data=f'delete_{item[0]}')])
+            f"🗑️ {item[1]}", callback_data=callbacks.encode(callbacks.DELETE_PRODUCT, item[0]))])
     
+    keyboard += views.page_buttons(page, callbacks.DELETE_ITEMS_PAGE)
     keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data='admin_panel')])
     
-    await context.bot.send_message(
-        query.message.chat_id,
+    await show_screen(
+        query,
+        context,
         response,
-        parse_mode='Markdown',
+        parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
 
 # Delete a specific product
-async def delete_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def delete_product(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id):
     query = update.callback_query
-    await query.answer()
-    
-    product_id = query.data.replace('delete_', '')
     
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM items WHERE id = ?", (product_id,))
-    conn.commit()
-    conn.close()
+    await catalog.delete_item(product_id)
     
     keyboard = [
         [InlineKeyboardButton("🗑️ Delete Another Product", callback_data='delete_items')],
         [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
     ]
     
-    await context.bot.send_message(
-        query.message.chat_id,
+    await show_screen(
+        query,
+        context,
         "✅ Product deleted successfully!",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
 
 # Manage categories
 async def manage_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     
-    categories = get_categories()
+    categories = await catalog.get_categories()
     
-    response = "📂 *Current Categories:*\n\n"
+    response = "📂 <b>Current Categories:</b>\n\n"
     for category in categories:
-        response += f"• {category}\n"
+        response += f"• {html.escape(category, quote=False)}\n"
     
     keyboard = [
         [InlineKeyboardButton("➕ Add New Category", callback_data='add_category_direct')],
         [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data='admin_panel')]
     ]
     
-    await context.bot.send_message(
-        query.message.chat_id,
+    await show_screen(
+        query,
+        context,
         response,
-        parse_mode='Markdown',
+        parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
 
 # Add category directly
 async def add_category_direct(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     
-    await context.bot.send_message(
-        query.message.chat_id,
+    await show_screen(
+        query,
+        context,
         "📂 Please enter the new category name:",
         parse_mode='Markdown'
     )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
     
     return ADD_CATEGORY
 
 # Add new category directly
 async def add_category_direct_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     category_name = update.message.text
-    success = add_category(category_name)
+    success = await catalog.add_category(category_name)
     
     if success:
         await update.message.reply_text(
-            f"✅ Category '{category_name}' added successfully!",
-            parse_mode='Markdown'
+            f"✅ Category '{html.escape(category_name, quote=False)}' added successfully!",
+            parse_mode='HTML'
         )
     else:
         await update.message.reply_text(
-            f"❌ Category '{category_name}' already exists.",
-            parse_mode='Markdown'
+            f"❌ Category '{html.escape(category_name, quote=False)}' already exists.",
+            parse_mode='HTML'
         )
     
     return ConversationHandler.END
 
+# Bulk import command, the next document the admin sends is imported
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+
+    context.user_data['awaiting_import'] = True
+    await update.message.reply_text(
+        "📥 Send a CSV file with a *name,price,category* header, a JSONL file with one "
+        "product object per line, or a JSON file with an array of them. Products with an existing name are updated.",
+        parse_mode='Markdown'
+    )
+
+# Import an uploaded CSV/JSONL/JSON document
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id) or not context.user_data.get('awaiting_import'):
+        return
+
+    document = update.message.document
+    file_format = bulk.file_format(document.file_name)
+    if file_format is None:
+        await update.message.reply_text("❌ Please send a .csv, .jsonl or .json file.")
+        return
+
+    context.user_data['awaiting_import'] = False
+    # Sent through the bot, Message shortcuts don't take rate_limit_args
+    status = await context.bot.send_message(
+        chat_id=update.effective_chat.id, text="⏳ Importing...", rate_limit_args=PRIORITY_ADMIN
+    )
+    last_report = time.monotonic()
+    imported = 0
+
+    async def report(text, parse_mode=None):
+        await context.bot.edit_message_text(
+            chat_id=status.chat_id, message_id=status.message_id, text=text, parse_mode=parse_mode,
+            rate_limit_args=PRIORITY_ADMIN
+        )
+
+    async def progress(done):
+        nonlocal last_report, imported
+        imported = done
+        if time.monotonic() - last_report < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_report = time.monotonic()
+        try:
+            await report(f"⏳ Imported {done} products so far...")
+        except TelegramError as error:
+            # Only the progress report is lost, keep importing
+            logger.warning("import progress update failed: %s", error)
+
+    # The directory and the downloaded file in it are removed however the import ends
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'import.{file_format}')
+        try:
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_drive(path)
+        except (TelegramError, OSError) as error:
+            logger.warning("import download failed: %s", error)
+            await report(f"❌ Could not download the file: {error}")
+            return
+        try:
+            result = await bulk.import_file(path, file_format, progress)
+        except ValueError as error:
+            await report(f"❌ Import stopped after {imported} products: {error}")
+            return
+        except Exception:
+            logger.exception("import failed")
+            await report(f"❌ Import failed after {imported} products, see the bot log.")
+            return
+
+    response = (
+        f"✅ <b>Import finished</b>\n\n• Added: {result.inserted}\n• Updated: {result.updated}\n"
+        f"• Skipped lines: {result.error_count}"
+    )
+    if result.errors:
+        response += "\n\n" + "\n".join(html.escape(error, quote=False) for error in result.errors)
+        if result.error_count > len(result.errors):
+            response += f"\n… and {result.error_count - len(result.errors)} more"
+    await report(response, parse_mode='HTML')
+
+# Export the catalog as a document, /export [csv|jsonl]
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        return
+
+    file_format = context.args[0].lower() if context.args else 'csv'
+    if file_format not in bulk.EXPORT_FORMATS:
+        await update.message.reply_text("Usage: /export [csv|jsonl]")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'catalog.{file_format}')
+        count = await bulk.export_file(path, file_format)
+        with open(path, 'rb') as document:
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id, document=document, filename=f'catalog.{file_format}',
+                caption=f"📤 {count} products", rate_limit_args=PRIORITY_ADMIN
+            )
+
 # Stats command for admin
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.callback_query:
-        query = update.callback_query
-        await query.answer()
-        chat_id = query.message.chat_id
-        message_id = query.message.message_id
-    else:
+    # Set when opened from a button
+    query = update.callback_query
+    if not query:
         if not is_admin(update.effective_user.id):
             await update.message.reply_text("🚫 You are not authorized to use this command.")
             return
-        chat_id = update.message.chat_id
-        message_id = None
         
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM items")
-    total_items = cursor.fetchone()[0]
+    total_items, total_categories, total_value, average_value, categories = await storage.get_stats()
     
-    cursor.execute("SELECT COUNT(DISTINCT category) FROM items")
-    total_categories = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT category, COUNT(*) FROM items GROUP BY category")
-    categories = cursor.fetchall()
-    
-    cursor.execute("SELECT SUM(price) FROM items")
-    total_value = cursor.fetchone()[0] or 0
-    
-    conn.close()
-    
-    response = "📊 *Store Statistics:*\n\n"
+    response = "📊 <b>Store Statistics:</b>\n\n"
     response += f"• Total Products: {total_items}\n"
     response += f"• Total Inventory Value: {total_value:.2f} ETB\n"
+    response += f"• Average Price: {average_value:.2f} ETB\n"
     response += f"• Categories: {total_categories}\n\n"
-    response += "📂 *Items by Category:*\n"
+    response += "📂 <b>Items by Category:</b>\n"
     
     for category, count in categories:
-        response += f"• {category}: {count} items\n"
+        response += f"• {html.escape(category, quote=False)}: {count} items\n"
+
+    cache = catalog.cache_stats()
+    response += f"\n⚡ <b>Catalog Cache:</b> {cache['hits']} hits / {cache['misses']} misses (version {cache['version']})\n"
+    rendered = views.render_cache_stats()
+    response += f"🖼 <b>Rendered Screens:</b> {rendered['hits']} hits / {rendered['misses']} misses ({rendered['size']} cached)\n"
+    response += "🚀 <b>Startup:</b> " + ", ".join(
+        f"{phase.replace('_', ' ')} {seconds * 1000:.0f} ms" for phase, seconds in startup.phases.items()
+    ) + "\n"
+
+    limiter = context.bot.rate_limiter
+    if limiter is not None:
+        outbound = limiter.metrics()
+        sent = sum(outbound['sent'].values())
+        average_wait = sum(outbound['wait_seconds'].values()) / sent if sent else 0
+        response += (
+            f"📤 <b>Outbound Queue:</b> {outbound['queue_depth']} waiting, "
+            f"avg wait {average_wait * 1000:.0f} ms, {outbound['retry_after']} flood waits\n"
+        )
     
     keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data='admin_panel')]]
     
     if update.callback_query:
-        await context.bot.send_message(chat_id, response, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
-        await context.bot.delete_message(chat_id, message_id)
+        await show_screen(query, context, response, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
     else:
-        await update.message.reply_text(response, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+        await update.message.reply_text(response, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
 
 # Cancel conversation
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -642,198 +681,83 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Operation cancelled.")
     return ConversationHandler.END
 
-# Button callback handler
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-
-    if query.data == 'list':
-        await list_items(query, context)
-    elif query.data == 'sort':
-        await sort_items(query, context)
-    elif query.data == 'filter':
-        await filter_categories(query, context)
-    elif query.data == 'search':
-        await search_request(query, context)
-    elif query.data.startswith('category_'):
-        category = query.data.split('_', 1)[1]
-        await show_category_items(query, context, category)
-    elif query.data == 'back_to_menu':
-        await start_callback(query, context)
-    elif query.data == 'back_to_categories':
-        await filter_categories(query, context)
-    elif query.data == 'admin_panel':
-        await admin_panel(update, context)
-    elif query.data == 'add_item':
-        await start_add_item(update, context)
-    elif query.data == 'stats':
-        await stats(update, context)
-    elif query.data == 'edit_items':
-        await edit_items(update, context)
-    elif query.data.startswith('edit_'):
-        await edit_product(update, context)
-    elif query.data.startswith('edit_field_'):
-        await edit_field(update, context)
-    elif query.data.startswith('edit_cat_'):
-        await edit_category(update, context)
-    elif query.data == 'delete_items':
-        await delete_items(update, context)
-    elif query.data.startswith('delete_'):
-        await delete_product(update, context)
-    elif query.data == 'manage_categories':
-        await manage_categories(update, context)
-    elif query.data == 'add_category_direct':
-        await add_category_direct(update, context)
-
 # List all items
-async def list_items(query, context):
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, price, category FROM items")
-    items = cursor.fetchall()
-    conn.close()
-
-    if not items:
-        keyboard = [[InlineKeyboardButton("🏠 Back to Main Menu", callback_data='back_to_menu')]]
-        await context.bot.send_message(
-            query.message.chat_id,
-            "📭 Our catalog is currently empty. Check back soon for new products!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        await context.bot.delete_message(query.message.chat_id, query.message.message_id)
-        return
-
-    response = "📦 *All Products:*\n\n"
-    for item in items:
-        response += f"• *{item[0]}* - {item[1]:.2f} ETB ({item[2]})\n"
-
-    keyboard = [
-        [InlineKeyboardButton("🔄 Sort A-Z", callback_data='sort')],
-        [InlineKeyboardButton("📂 Filter by Category", callback_data='filter')],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
-    ]
-    
-    await context.bot.send_message(
-        query.message.chat_id,
-        response,
-        parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
+async def list_items(update: Update, context: ContextTypes.DEFAULT_TYPE, page=None):
+    after, before, _ = page or (None, None, None)
+    await show_view(update.callback_query, context, await views.list_screen(after, before))
 
 # Sort items A-Z
-async def sort_items(query, context):
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, price, category FROM items ORDER BY name")
-    items = cursor.fetchall()
-    conn.close()
-
-    if not items:
-        keyboard = [[InlineKeyboardButton("🏠 Back to Main Menu", callback_data='back_to_menu')]]
-        await context.bot.send_message(
-            query.message.chat_id,
-            "📭 Our catalog is currently empty. Check back soon for new products!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        await context.bot.delete_message(query.message.chat_id, query.message.message_id)
-        return
+async def sort_items(update: Update, context: ContextTypes.DEFAULT_TYPE, page=None):
+    after, before, _ = page or (None, None, None)
+    await show_view(update.callback_query, context, await views.sort_screen(after, before))
 
-    response = "🔠 *Products Sorted A-Z:*\n\n"
-    for item in items:
-        response += f"• *{item[0]}* - {item[1]:.2f} ETB ({item[2]})\n"
+# Browse by price, see callbacks.PriceView
+async def price_items(update: Update, context: ContextTypes.DEFAULT_TYPE, view):
+    await show_view(update.callback_query, context, await views.price_screen(view))
 
-    keyboard = [
-        [InlineKeyboardButton("📋 View All Products", callback_data='list')],
-        [InlineKeyboardButton("📂 Filter by Category", callback_data='filter')],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
-    ]
-    
-    await context.bot.send_message(
-        query.message.chat_id,
-        response,
-        parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
+# Another page of a by-price listing, the PriceView travels as the page suffix
+async def price_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page):
+    await show_view(update.callback_query, context, await views.price_screen(page.suffix, page.after, page.before))
 
 # Show categories for filtering
-async def filter_categories(query, context):
-    categories = get_categories()
-
-    if not categories:
-        keyboard = [[InlineKeyboardButton("🏠 Back to Main Menu", callback_data='back_to_menu')]]
-        await context.bot.send_message(
-            query.message.chat_id,
-            "📭 No categories available yet. Check back soon!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        await context.bot.delete_message(query.message.chat_id, query.message.message_id)
-        return
-
-    keyboard = []
-    for category in categories:
-        keyboard.append([InlineKeyboardButton(
-            f"📂 {category}", callback_data=f'category_{category}')])
-    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')])
-
-    await context.bot.send_message(
-        query.message.chat_id,
-        "📂 *Select a category:*",
-        parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
+async def filter_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await show_view(update.callback_query, context, await views.categories_screen())
 
 # Show items in specific category
-async def show_category_items(query, context, category):
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT name, price, category FROM items WHERE category = ?",
-        (category,)
-    )
-    items = cursor.fetchall()
-    conn.close()
-
-    if not items:
-        keyboard = [
-            [InlineKeyboardButton("📂 Back to Categories", callback_data='back_to_categories')],
-            [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
-        ]
-        await context.bot.send_message(
-            query.message.chat_id,
-            f"📭 No products found in '{category}' category. Check back soon!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        await context.bot.delete_message(query.message.chat_id, query.message.message_id)
+async def show_category_items(update: Update, context: ContextTypes.DEFAULT_TYPE, category_id):
+    await show_view(update.callback_query, context, await views.category_screen(category_id))
+
+# A user's new product alerts for one category
+async def category_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE, category_id):
+    category = await catalog.category_name(category_id)
+    if category is None:
+        await show_view(update.callback_query, context, await views.categories_screen())
         return
+    subscribed = await storage.is_subscribed(update.effective_user.id, category)
+    await show_view(update.callback_query, context, views.alerts_screen(category_id, category, subscribed))
+
+# Turn alerts for a category on or off, the button says which so repeated taps agree
+async def set_category_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE, setting):
+    category_id, subscribe = setting
+    category = await catalog.category_name(category_id)
+    if category is None:
+        await show_view(update.callback_query, context, await views.categories_screen())
+        return
+    await storage.set_subscription(update.effective_user.id, category, subscribe)
+    await show_view(update.callback_query, context, views.alerts_screen(category_id, category, subscribe))
 
-    response = f"📂 *Products in {category}:*\n\n"
-    for item in items:
-        response += f"• *{item[0]}* - {item[1]:.2f} ETB\n"
-
-    keyboard = [
-        [InlineKeyboardButton("📂 Back to Categories", callback_data='back_to_categories')],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
-    ]
-    
-    await context.bot.send_message(
-        query.message.chat_id,
-        response,
-        parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
+# Photos of the products on a category page, as albums sent by file_id
+async def category_photos(update: Update, context: ContextTypes.DEFAULT_TYPE, page):
+    query = update.callback_query
+    category = await catalog.category_name(page.suffix)
+    if category is None:
+        await show_view(query, context, await views.categories_screen())
+        return
+    items = (await catalog.items_page('name', category=category, after=page.after, before=page.before)).items
+    albums = views.photo_albums(items, await storage.get_photos([item[0] for item in items]))
+    chat_id = query.message.chat_id
+    try:
+        for album in albums:
+            if len(album) == 1:
+                await context.bot.send_photo(chat_id, album[0].media, caption=album[0].caption)
+            else:
+                await context.bot.send_media_group(chat_id, album)
+    except BadRequest:
+        # A file_id Telegram no longer knows, the admin has to upload that photo again
+        await context.bot.send_message(chat_id, "🖼 Some photos are not available right now.")
+
+# Another page of a category, the category id travels as the page suffix
+async def category_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page):
+    await show_view(update.callback_query, context, await views.category_screen(page.suffix, page.after, page.before))
 
 # Search request handler
-async def search_request(query, context):
-    await context.bot.send_message(
-        query.message.chat_id,
+async def search_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await show_screen(
+        update.callback_query,
+        context,
         "🔍 What would you like to search for? Please type your search term:"
     )
     context.user_data['awaiting_search'] = True
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
 
 # Handle search messages
 async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -841,118 +765,224 @@ async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     search_term = update.message.text.lower()
-    conn = sqlite3.connect('items.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT name, price, category FROM items WHERE LOWER(name) LIKE ?",
-        (f'%{search_term}%',)
-    )
-    items = cursor.fetchall()
-    conn.close()
-
-    if not items:
-        keyboard = [[InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]]
-        await update.message.reply_text(
-            f"🔍 No products found matching '{search_term}'. Try different keywords or browse our full catalog!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        context.user_data['awaiting_search'] = False
-        return
-
-    response = f"🔍 *Search results for '{search_term}':*\n\n"
-    for item in items:
-        response += f"• *{item[0]}* - {item[1]:.2f} ETB ({item[2]})\n"
-
-    keyboard = [[InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]]
-    await update.message.reply_text(response, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+    context.user_data['search_term'] = search_term
     context.user_data['awaiting_search'] = False
+    screen = await views.search_screen(search_term)
+    await update.message.reply_text(screen.text, parse_mode=screen.parse_mode, reply_markup=screen.reply_markup)
+
+# Show another page of the last search
+async def search_page(update: Update, context: ContextTypes.DEFAULT_TYPE, offset):
+    search_term = context.user_data.get('search_term')
+    if search_term is None:
+        await search_request(update, context)
+        return
 
-# Start callback for back button
-async def start_callback(query, context):
-    welcome_text = """
-🛍️ *Welcome to Sami Shopping* 🛍️
-
-Discover amazing products, compare prices, and find exactly what you're looking for with ease!
-
-✨ *Features:*
-• 📋 Browse our complete product catalog
-• 🔍 Search for specific items
-• 🔠 Sort products alphabetically
-• 📂 Filter by category
+    await show_view(update.callback_query, context, await views.search_screen(search_term, offset))
 
-Use the menu below to start exploring! 👇
-    """
-    
-    # Add admin note if user is admin
-    if is_admin(query.from_user.id):
-        welcome_text += "\n\n👑 *You have admin privileges!* Use /admin to access admin panel."
-    
-    keyboard = [
-        [InlineKeyboardButton("📋 Browse All Products", callback_data='list')],
-        [InlineKeyboardButton("🔍 Search Products", callback_data='search')],
-        [InlineKeyboardButton("🔠 Sort A-Z", callback_data='sort')],
-        [InlineKeyboardButton("📂 Filter by Category", callback_data='filter')]
+# Inline mode: "@bot query" in any chat, answered from the prefix index
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inline_query = update.inline_query
+    try:
+        offset = max(int(inline_query.offset or 0), 0)
+    except ValueError:
+        offset = 0
+
+    found = await prefixindex.search(inline_query.query, offset, INLINE_PAGE_SIZE)
+    results = [
+        InlineQueryResultArticle(
+            id=str(item_id),
+            title=name,
+            description=f"{price:.2f} ETB · {category}",
+            input_message_content=InputTextMessageContent(
+                f"🛍 <b>{html.escape(name, quote=False)}</b>\n💰 {price:.2f} ETB\n📂 {html.escape(category, quote=False)}",
+                parse_mode='HTML',
+            ),
+        )
+        for item_id, name, price, category in found.items
     ]
-    
-    # Add admin button if user is admin
-    if is_admin(query.from_user.id):
-        keyboard.append([InlineKeyboardButton("👑 Admin Panel", callback_data='admin_panel')])
-    
-    await context.bot.send_message(
-        query.message.chat_id,
-        welcome_text,
-        parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard)
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        next_offset=str(offset + INLINE_PAGE_SIZE) if found.has_next else '',
     )
-    await context.bot.delete_message(query.message.chat_id, query.message.message_id)
-
-def main():
-    init_db()
-    app = Application.builder().token(TOKEN).build()
 
+# Start callback for back button
+async def start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await show_view(query, context, await views.welcome_screen(is_admin(query.from_user.id), back=True))
+
+# Buttons from an older callback format or for something that is gone
+async def expired_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer("⌛ This button has expired, here is the current menu.")
+    await start_callback(update, context)
+
+# Every inline button of the bot, see router.py and callbacks.py. Conversation
+# steps are routed here too and picked out by the ConversationHandlers via router.pattern().
+router = CallbackRouter()
+router.exact('list', list_items)
+router.prefix(callbacks.prefix(callbacks.LIST_PAGE), list_items, callbacks.parse_page)
+router.exact('sort', sort_items)
+router.prefix(callbacks.prefix(callbacks.SORT_PAGE), sort_items, callbacks.parse_page)
+router.prefix(callbacks.prefix(callbacks.PRICE), price_items, callbacks.parse_price)
+router.prefix(callbacks.prefix(callbacks.PRICE_PAGE), price_page, callbacks.parse_price_page)
+router.exact('filter', filter_categories)
+router.exact('back_to_categories', filter_categories)
+router.prefix(callbacks.prefix(callbacks.CATEGORY), show_category_items, callbacks.parse_id)
+router.prefix(callbacks.prefix(callbacks.CATEGORY_PAGE), category_page, callbacks.parse_page)
+router.prefix(callbacks.prefix(callbacks.PHOTOS), category_photos, callbacks.parse_photos)
+router.prefix(callbacks.prefix(callbacks.ALERTS), category_alerts, callbacks.parse_id)
+router.prefix(callbacks.prefix(callbacks.SET_ALERTS), set_category_alerts, callbacks.parse_set_alerts)
+router.exact('search', search_request)
+router.prefix(callbacks.prefix(callbacks.SEARCH_PAGE), search_page, callbacks.parse_id)
+router.exact('back_to_menu', start_callback)
+router.exact('admin_panel', admin_panel)
+router.exact('stats', stats)
+router.exact('add_item', start_add_item)
+router.prefix(callbacks.prefix(callbacks.ADD_TO_CATEGORY), handle_category, callbacks.parse_id)
+router.exact('add_new_category', handle_category)
+router.exact('edit_items', edit_items)
+router.prefix(callbacks.prefix(callbacks.EDIT_ITEMS_PAGE), edit_items, callbacks.parse_page)
+router.prefix(callbacks.prefix(callbacks.EDIT_PRODUCT), edit_product, callbacks.parse_id)
+router.prefix(callbacks.prefix(callbacks.EDIT_FIELD), edit_field, callbacks.parse_field)
+router.prefix(callbacks.prefix(callbacks.EDIT_CATEGORY), edit_category, callbacks.parse_id)
+router.exact('delete_items', delete_items)
+router.prefix(callbacks.prefix(callbacks.DELETE_ITEMS_PAGE), delete_items, callbacks.parse_page)
+router.prefix(callbacks.prefix(callbacks.DELETE_PRODUCT), delete_product, callbacks.parse_id)
+router.exact('manage_categories', manage_categories)
+router.exact('add_category_direct', add_category_direct)
+router.unmatched(expired_button)
+
+async def load_search_index():
+    started = time.perf_counter()
+    await prefixindex.ensure_loaded()
+    startup.record('search_index', time.perf_counter() - started)
+
+# Once the bot is initialized and before it takes updates: start the /metrics endpoint
+# and warm the caches, then load the search index and start notifying in the background
+async def on_startup(app: Application):
+    startup.mark('initialize')
+    app.bot_data['metrics_server'] = await metrics.start_metrics_server(app)
+    await views.warm_up()
+    startup.mark('warm_up')
+    startup.report()
+    app.bot_data['search_index'] = asyncio.create_task(load_search_index())
+    app.bot_data['notifications'] = asyncio.create_task(notifications.run(app.bot))
+
+# Stop notifying while the bot can still finish the requests in flight
+async def on_stop(app: Application):
+    task = app.bot_data.pop('notifications', None)
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+# Stop the metrics endpoint and release the shared database connections when the bot stops
+async def on_shutdown(app: Application):
+    # Let a search index load started moments ago finish its database reads
+    loading = app.bot_data.pop('search_index', None)
+    if loading is not None:
+        await asyncio.gather(loading, return_exceptions=True)
+    server = app.bot_data.pop('metrics_server', None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    storage.close_db()
+
+# Register every handler of the bot, shared by main() and benchmark.py
+def add_handlers(app: Application):
     # Add conversation handler for adding items
     add_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_add_item, pattern='^add_item$')],
+        entry_points=[CallbackQueryHandler(router.dispatch, pattern=router.pattern('add_item'))],
         states={
             NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_name)],
             PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_price)],
-            CATEGORY: [CallbackQueryHandler(handle_category, pattern='^(cat_|add_new_category)')],
+            PHOTO: [
+                MessageHandler(filters.PHOTO | (filters.TEXT & ~filters.COMMAND), get_photo),
+                CommandHandler('skip', get_photo),
+            ],
+            CATEGORY: [CallbackQueryHandler(router.dispatch, pattern=router.pattern(callbacks.prefix(callbacks.ADD_TO_CATEGORY), 'add_new_category'))],
             ADD_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_new_category)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='add',
+        persistent=True,
     )
 
     # Add conversation handler for editing items
     edit_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(edit_field, pattern='^edit_field_')],
+        entry_points=[CallbackQueryHandler(router.dispatch, pattern=router.pattern(callbacks.prefix(callbacks.EDIT_FIELD)))],
         states={
             EDIT_VALUE: [
-                CallbackQueryHandler(edit_category, pattern='^edit_cat_'),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, edit_value)
+                CallbackQueryHandler(router.dispatch, pattern=router.pattern(callbacks.prefix(callbacks.EDIT_CATEGORY))),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, edit_value),
+                MessageHandler(filters.PHOTO, edit_value),
+                CommandHandler('skip', edit_value),
             ],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='edit',
+        persistent=True,
     )
 
     # Add conversation handler for adding categories directly
     category_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(add_category_direct, pattern='^add_category_direct$')],
+        entry_points=[CallbackQueryHandler(router.dispatch, pattern=router.pattern('add_category_direct'))],
         states={
             ADD_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_category_direct_handler)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='category',
+        persistent=True,
     )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("admin", admin_panel))
     app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("import", import_command))
+    app.add_handler(CommandHandler("export", export_command))
     app.add_handler(add_conv_handler)
     app.add_handler(edit_conv_handler)
     app.add_handler(category_conv_handler)
-    app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_handler(CallbackQueryHandler(router.dispatch))
+    app.add_handler(InlineQueryHandler(inline_search))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, search_handler))
+    app.add_handler(MessageHandler(filters.Document.ALL, import_document))
+
+# The bot with every handler registered, in this process or in a worker (see workers.py),
+# global_rate is the share of the overall Bot API message rate it may use
+def build_app(global_rate=GLOBAL_RATE):
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(BOT_API_URL)
+        .base_file_url(BOT_API_FILE_URL)
+        .rate_limiter(OutboundScheduler(global_rate=global_rate))
+        .concurrent_updates(PerUserUpdateProcessor())
+        .persistence(SQLitePersistence())
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    add_handlers(app)
+    metrics.instrument_handlers(app, router)
+    return app
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s', level=logging.INFO)
+    # Every Bot API request would be logged otherwise
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    if WORKER_PROCESSES:
+        run_workers(build_app, TOKEN, BOT_API_URL, BOT_MODE)
+        return
 
-    app.run_polling()
+    storage.init_db()
+    startup.mark('database')
+    app = build_app()
+    startup.mark('build')
+    if BOT_MODE == 'webhook':
+        run_webhook(app)
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
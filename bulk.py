@@ -0,0 +1,154 @@
+import csv
+import json
+import math
+import os
+from typing import Iterator, List, NamedTuple, Tuple
+
+import catalog
+import storage
+
+# Products per upsert transaction
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Invalid lines reported back to the admin, the rest are only counted
+MAX_REPORTED_ERRORS = 10
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+CSV_FIELDS = ('name', 'price', 'category')
+
+
+class ImportResult(NamedTuple):
+    inserted: int
+    updated: int
+    errors: List[str]
+    error_count: int
+
+
+# Format from the file name, None if it isn't one we read
+def file_format(file_name):
+    extension = os.path.splitext(file_name or '')[1].lower().lstrip('.')
+    if extension in ('csv', 'txt'):
+        return 'csv'
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'json':
+        return 'json'
+    return None
+
+
+# Check one record and turn it into a (name, price, category) row
+def _validate(record) -> Tuple[str, float, str]:
+    if not isinstance(record, dict):
+        raise ValueError("expected an object with name, price and category")
+    name = str(record.get('name') or '').strip()
+    category = str(record.get('category') or '').strip()
+    if not name:
+        raise ValueError("missing name")
+    if not category:
+        raise ValueError("missing category")
+    try:
+        price = float(record.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid price {record.get('price')!r}")
+    if not math.isfinite(price):
+        raise ValueError(f"invalid price {record.get('price')!r}")
+    if not price > 0:
+        raise ValueError("price must be positive")
+    return name, price, category
+
+
+# Yield (line number, row or error message) from an open text file, one line at a
+# time; for a JSON array, which is read whole, the number is the product's position
+def parse_rows(stream, file_format) -> Iterator[Tuple[int, object]]:
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        missing = [field for field in CSV_FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            yield 1, f"header is missing {', '.join(missing)}"
+            return
+        for record in reader:
+            try:
+                yield reader.line_num, _validate(record)
+            except ValueError as error:
+                yield reader.line_num, str(error)
+        return
+
+    if file_format == 'json':
+        try:
+            records = json.load(stream)
+        except UnicodeDecodeError:
+            # Reported by import_file like for the other formats
+            raise
+        except ValueError as error:
+            raise ValueError(f"invalid JSON: {error}") from error
+        if not isinstance(records, list):
+            raise ValueError("expected a JSON array of products")
+        for position, record in enumerate(records, 1):
+            try:
+                yield position, _validate(record)
+            except ValueError as error:
+                yield position, str(error)
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, _validate(json.loads(line))
+        except ValueError as error:
+            yield line_number, str(error)
+
+
+# Upsert a CSV, JSONL or JSON file in batches, awaiting progress(rows done) after each batch
+async def import_file(path, file_format, progress=None) -> ImportResult:
+    inserted = updated = error_count = done = 0
+    errors = []
+    batch = []
+
+    async def flush():
+        nonlocal inserted, updated, done
+        added, changed = await catalog.upsert_items(batch)
+        inserted += added
+        updated += changed
+        done += len(batch)
+        batch.clear()
+        if progress is not None:
+            await progress(done)
+
+    # Problems with the file as a whole end the import, batches already
+    # upserted stay; they surface as ValueError with a message for the admin
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as stream:
+            for line_number, row in parse_rows(stream, file_format):
+                if isinstance(row, str):
+                    error_count += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append(f"{'product' if file_format == 'json' else 'line'} {line_number}: {row}")
+                    continue
+                batch.append(row)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    await flush()
+    except UnicodeDecodeError as error:
+        raise ValueError("the file is not UTF-8 text") from error
+    except csv.Error as error:
+        raise ValueError(f"unreadable CSV: {error}") from error
+    if batch:
+        await flush()
+
+    return ImportResult(inserted, updated, errors, error_count)
+
+
+# Write the whole catalog to path without holding it in memory, returns the product count
+async def export_file(path, file_format) -> int:
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        if file_format == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(('id',) + CSV_FIELDS)
+            return await storage.export_items(writer.writerows)
+
+        def write_rows(rows):
+            out.writelines(
+                json.dumps({'id': row[0], 'name': row[1], 'price': row[2], 'category': row[3]}, ensure_ascii=False) + '\n'
+                for row in rows
+            )
+
+        return await storage.export_items(write_rows)
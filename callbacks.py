@@ -0,0 +1,147 @@
+import string
+from typing import Any, NamedTuple, Optional
+
+# Compact callback_data for buttons that carry ids:
+#
+#     <version><action>:<arg>.<arg>...
+#
+# Arguments are non-negative integers in base 36, so categories and products
+# travel as their row ids and every button stays far below Telegram's 64 byte
+# limit. Bump CALLBACK_VERSION whenever the meaning of an action or its
+# arguments changes; buttons drawn by an older version then no longer match
+# any route and are answered as expired instead of being misread.
+CALLBACK_VERSION = '1'
+
+# Actions
+LIST_PAGE = 'l'
+SORT_PAGE = 's'
+CATEGORY = 'c'
+CATEGORY_PAGE = 'p'
+SEARCH_PAGE = 'q'
+ADD_TO_CATEGORY = 'a'
+EDIT_PRODUCT = 'e'
+EDIT_FIELD = 'f'
+EDIT_CATEGORY = 'g'
+DELETE_PRODUCT = 'd'
+EDIT_ITEMS_PAGE = 'i'
+DELETE_ITEMS_PAGE = 'x'
+PRICE = 'o'
+PRICE_PAGE = 'r'
+PHOTOS = 'h'
+ALERTS = 'n'
+SET_ALERTS = 't'
+
+# Page directions
+PREV = 0
+NEXT = 1
+
+# Fields an edit button may name, by index; append only
+FIELDS = ('name', 'price', 'category', 'photo_file_id')
+
+# storage.PAGE_ORDERS a by-price button may name, by index; append only
+PRICE_ORDERS = ('price', 'price_desc')
+
+_DIGITS = string.digits + string.ascii_lowercase
+
+
+# Position of a keyset page button, suffix is the category id on category pages
+# and the PriceView on by-price pages
+class PageAnchor(NamedTuple):
+    after: Optional[int]
+    before: Optional[int]
+    suffix: Any
+
+
+# By-price browse settings: a PRICE_ORDERS order, the index of a
+# storage.PRICE_BUCKETS range and a category id, None for all
+class PriceView(NamedTuple):
+    order: str
+    bucket: Optional[int]
+    category_id: Optional[int]
+
+    # Arguments of its PRICE button, and the suffix of its page buttons
+    def args(self):
+        bucket = 0 if self.bucket is None else self.bucket + 1
+        return PRICE_ORDERS.index(self.order), bucket, self.category_id or 0
+
+
+def _base36(number):
+    if number < 0:
+        raise ValueError("callback arguments must not be negative")
+    digits = ''
+    while True:
+        number, digit = divmod(number, 36)
+        digits = _DIGITS[digit] + digits
+        if not number:
+            return digits
+
+
+# Route prefix of an action, what router.prefix() is registered with
+def prefix(action):
+    return f'{CALLBACK_VERSION}{action}:'
+
+
+def encode(action, *args):
+    return prefix(action) + '.'.join(_base36(arg) for arg in args)
+
+
+# Arguments after the route prefix, ValueError if malformed
+def decode(payload):
+    return tuple(int(arg, 36) for arg in payload.split('.'))
+
+
+def parse_id(payload):
+    (value,) = decode(payload)
+    return value
+
+
+def parse_field(payload):
+    index = parse_id(payload)
+    if index >= len(FIELDS):
+        raise ValueError(f"unknown field {index}")
+    return FIELDS[index]
+
+
+def _page_anchor(direction, anchor, suffix):
+    if direction == PREV:
+        return PageAnchor(None, anchor, suffix)
+    if direction == NEXT:
+        return PageAnchor(anchor, None, suffix)
+    raise ValueError(f"bad page direction {direction}")
+
+
+def parse_page(payload):
+    direction, anchor, *suffix = decode(payload)
+    return _page_anchor(direction, anchor, suffix[0] if suffix else None)
+
+
+def _price_view(order, bucket, category_id):
+    if order >= len(PRICE_ORDERS):
+        raise ValueError(f"unknown price order {order}")
+    return PriceView(PRICE_ORDERS[order], bucket - 1 if bucket else None, category_id or None)
+
+
+def parse_price(payload):
+    order, bucket, category_id = decode(payload)
+    return _price_view(order, bucket, category_id)
+
+
+# PageAnchor of the category page a PHOTOS button was drawn on, whose
+# suffix is the category id; the first page is sent as NEXT after 0
+def parse_photos(payload):
+    page = parse_page(payload)
+    return page._replace(after=page.after or None)
+
+
+# (category id, whether to subscribe) of a SET_ALERTS button
+def parse_set_alerts(payload):
+    category_id, subscribe = decode(payload)
+    if subscribe > 1:
+        raise ValueError(f"bad subscription flag {subscribe}")
+    return category_id, bool(subscribe)
+
+
+# PageAnchor whose suffix is the PriceView
+def parse_price_page(payload):
+    direction, anchor, order, bucket, category_id = decode(payload)
+    return _page_anchor(direction, anchor, _price_view(order, bucket, category_id))
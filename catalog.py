@@ -0,0 +1,165 @@
+import os
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import metrics
+import notifications
+import prefixindex
+import storage
+
+MAX_CACHED_PAGES = int(os.getenv("CATALOG_CACHE_PAGES", "512"))
+
+# In-process copy of the browse data, only rebuilt after an admin write.
+# Every write bumps the version so reads that raced with it are not stored;
+# writes reach it as storage change events, see _apply().
+version = 0
+hits = 0
+misses = 0
+_categories = None
+_pages = OrderedDict()
+
+
+# Hit/miss counters for the admin statistics screen
+def cache_stats():
+    return {
+        'version': version,
+        'hits': hits,
+        'misses': misses,
+        'pages': len(_pages),
+    }
+
+
+# Drop cached pages (and categories) after the catalog changed
+def invalidate(categories=False):
+    global version, _categories
+    version += 1
+    _pages.clear()
+    if categories:
+        _categories = None
+
+
+# Cached (id, name) category rows, ordered by name
+async def get_category_rows() -> List[Tuple[int, str]]:
+    global hits, misses, _categories
+    if _categories is not None:
+        hits += 1
+        return list(_categories)
+
+    misses += 1
+    seen = version
+    categories = await storage.get_category_rows()
+    if seen == version:
+        _categories = categories
+    return list(categories)
+
+
+# Cached category list
+async def get_categories() -> List[str]:
+    return [name for _, name in await get_category_rows()]
+
+
+# Name of a category id, None if there is no such category
+async def category_name(category_id: int) -> Optional[str]:
+    for row_id, name in await get_category_rows():
+        if row_id == category_id:
+            return name
+    return None
+
+
+# Id of a category name, None if there is no such category
+async def category_id(name: str) -> Optional[int]:
+    for row_id, row_name in await get_category_rows():
+        if row_name == name:
+            return row_id
+    return None
+
+
+# Cached page of products, see storage.items_page
+async def items_page(order: str = 'id', category: Optional[str] = None, after: Optional[int] = None,
+                     before: Optional[int] = None, min_price: Optional[float] = None,
+                     max_price: Optional[float] = None) -> storage.Page:
+    global hits, misses
+    key = (order, category, after, before, min_price, max_price)
+    page = _pages.get(key)
+    if page is not None:
+        hits += 1
+        _pages.move_to_end(key)
+        return page
+
+    misses += 1
+    seen = version
+    page = await storage.items_page(
+        order, category=category, after=after, before=before, min_price=min_price, max_price=max_price
+    )
+    if seen == version:
+        _pages[key] = page
+        if len(_pages) > MAX_CACHED_PAGES:
+            _pages.popitem(last=False)
+    return page
+
+
+# Keep the caches, the search index and the notifier current with every
+# committed catalog write. Runs before the writing handler resumes, so it never
+# sees its own change missing, whichever module made the write.
+def _apply(change: storage.Change):
+    global version
+    metrics.catalog_changes.inc(change.kind)
+    if change.kind == 'category_added':
+        # Patch the cached list in place
+        version += 1
+        if _categories is not None:
+            _categories.append((change.row_id, change.values['name']))
+            _categories.sort(key=lambda row: row[1])
+    elif change.kind == 'items_imported':
+        # Imports may add categories
+        invalidate(categories=True)
+        prefixindex.mark_stale()
+        if change.values['inserted']:
+            notifications.items_added()
+    elif change.kind == 'item_added':
+        invalidate()
+        values = change.values
+        prefixindex.add(change.row_id, values['name'], values['price'], values['category'])
+        notifications.items_added()
+    elif change.kind == 'item_updated':
+        invalidate()
+        for field, value in change.values.items():
+            prefixindex.update(change.row_id, field, value)
+    elif change.kind == 'item_deleted':
+        invalidate()
+        prefixindex.remove(change.row_id)
+
+
+storage.on_change(_apply)
+
+
+# Add a category, False if it already exists
+async def add_category(category_name: str) -> bool:
+    return await storage.add_category(category_name) is not None
+
+
+# Add a product and return its id
+async def add_item(name: str, price: float, category: str, photo_file_id: Optional[str] = None) -> int:
+    return await storage.add_item(name, price, category, photo_file_id)
+
+
+# Change one field of a product
+async def update_item_field(item_id: int, field: str, value) -> bool:
+    return await storage.update_item_field(item_id, field, value)
+
+
+# Delete a product
+async def delete_item(item_id: int) -> bool:
+    return await storage.delete_item(item_id)
+
+
+# Bulk insert or update products, returns (inserted, updated)
+async def upsert_items(rows) -> Tuple[int, int]:
+    return await storage.upsert_items(rows)
+
+
+# Drop everything cached once another process sharing the database changed the catalog
+async def sync():
+    if await storage.catalog_changed_elsewhere():
+        invalidate(categories=True)
+        prefixindex.mark_stale()
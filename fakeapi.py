@@ -0,0 +1,241 @@
+# Local stand-in for the Telegram Bot API, to run the bot (and workers.py)
+# end to end on one machine without Telegram:
+#
+#     python fakeapi.py --port 8081 --users 2000 --updates 20 --rate 1000
+#     BOT_API_URL=http://127.0.0.1:8081/bot TELEGRAM_BOT_TOKEN=123:stub WORKER_PROCESSES=4 \
+#         OUTBOUND_GLOBAL_RATE=100000 python bot.py
+#
+# It serves getUpdates from a stream of synthetic customer traffic, answers the
+# methods the bot calls with plausible results, and reports how many updates
+# were answered and how long that took; GET /stats returns the same as JSON.
+import argparse
+import asyncio
+import collections
+import json
+import random
+import statistics
+import time
+from urllib.parse import parse_qsl
+
+import callbacks
+import views
+from httpserver import json_response, start_server
+
+BOT_USER = {'id': 123, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+SEARCH_TERMS = ['phone', 'lap', 'coffee table', 'gui', 'labtop']
+
+
+def _ok(result):
+    return json_response(200, {'ok': True, 'result': result})
+
+
+class FakeBotAPI:
+    def __init__(self, token):
+        self.token = token
+        self.update_ids = iter(range(1, 1 << 62))
+        self.message_ids = iter(range(1, 1 << 62))
+        # Updates not confirmed by a getUpdates offset yet
+        self.pending = collections.deque()
+        self.arrived = asyncio.Event()
+        self.calls = collections.Counter()
+        # Send times of updates waiting for their answer: callback query id -> time, chat id -> [times]
+        self.open_callbacks = {}
+        self.open_messages = collections.defaultdict(collections.deque)
+        self.sent = 0
+        self.latencies = []
+
+    def push(self, update):
+        self.pending.append(update)
+        self.sent += 1
+        self.arrived.set()
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+    def message(self, user_id, text):
+        update_id = next(self.update_ids)
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        self.open_messages[user_id].append(time.perf_counter())
+        self.push({'update_id': update_id, 'message': message})
+
+    def callback(self, user_id, data):
+        update_id = next(self.update_ids)
+        self.open_callbacks[str(update_id)] = time.perf_counter()
+        self.push({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': next(self.message_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': BOT_USER,
+                    'text': 'previous screen',
+                },
+            },
+        })
+
+    def _answered(self, started):
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+    def _sent_message(self, params):
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        timeout = float(params.get('timeout', 0))
+        while self.pending and self.pending[0]['update_id'] < offset:
+            self.pending.popleft()
+        if not self.pending and timeout:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [update for _, update in zip(range(limit), self.pending)]
+
+    async def call(self, method, params):
+        self.calls[method] += 1
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method == 'sendMessage':
+            chat = self.open_messages.get(int(params.get('chat_id', 0)))
+            self._answered(chat.popleft() if chat else None)
+            return self._sent_message(params)
+        if method in ('editMessageText', 'editMessageReplyMarkup', 'sendDocument', 'sendPhoto'):
+            return self._sent_message(params)
+        if method == 'sendMediaGroup':
+            media = params.get('media', [])
+            if isinstance(media, str):
+                media = json.loads(media)
+            return [self._sent_message(params) for _ in media]
+        if method == 'answerCallbackQuery':
+            self._answered(self.open_callbacks.pop(params.get('callback_query_id'), None))
+            return True
+        return True
+
+    def routes(self):
+        methods = [
+            'getMe', 'getUpdates', 'deleteWebhook', 'setWebhook', 'sendMessage', 'editMessageText',
+            'editMessageReplyMarkup', 'answerCallbackQuery', 'answerInlineQuery', 'deleteMessage', 'sendDocument',
+            'sendPhoto', 'sendMediaGroup',
+        ]
+        routes = {('GET', '/stats'): self.serve_stats}
+        for method in methods:
+            async def serve(request, method=method):
+                params = dict(parse_qsl(request.body.decode()))
+                if request.headers.get('content-type', '').startswith('application/json') and request.body:
+                    params = json.loads(request.body)
+                return _ok(await self.call(method, params))
+
+            routes[('POST', f'/bot{self.token}/{method}')] = serve
+        return routes
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        summary = {
+            'sent': self.sent,
+            'answered': len(latencies),
+            'unanswered': len(self.open_callbacks) + sum(len(times) for times in self.open_messages.values()),
+            'calls': dict(self.calls),
+        }
+        if latencies:
+            summary['latency_ms'] = {
+                'p50': round(statistics.median(latencies) * 1000, 2),
+                'p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+            }
+        return summary
+
+    async def serve_stats(self, request):
+        return json_response(200, self.stats())
+
+
+# Customers each sending `updates` taps and messages, `rate` updates per second overall
+async def generate_traffic(api, users, updates, rate, seed):
+    rng = random.Random(seed)
+    actions = [
+        lambda user: api.message(user, '/start'),
+        lambda user: api.callback(user, 'list'),
+        lambda user: api.callback(user, callbacks.encode(callbacks.LIST_PAGE, callbacks.NEXT, rng.randrange(1, 1000))),
+        lambda user: api.callback(user, views.PRICE_BUTTON),
+        lambda user: api.callback(user, 'filter'),
+        lambda user: api.callback(user, callbacks.encode(callbacks.SET_ALERTS, rng.randrange(1, 6), 1)),
+        lambda user: (api.callback(user, 'search'), api.message(user, rng.choice(SEARCH_TERMS))),
+    ]
+    started = time.perf_counter()
+    for index in range(users * updates):
+        rng.choice(actions)(rng.randrange(10_000, 10_000 + users))
+        # Sleep in slices so the rate holds without a timer per update
+        if index % 50 == 49:
+            delay = started + (index + 1) / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+async def main(args):
+    api = FakeBotAPI(args.token)
+    server = await start_server(args.host, args.port, api.routes())
+    print(f"Bot API stand-in on http://{args.host}:{args.port}/bot  token {args.token}")
+    try:
+        if args.users:
+            # Give the bot a moment to connect before the traffic starts
+            while not api.calls['getUpdates']:
+                await asyncio.sleep(0.1)
+            started = time.perf_counter()
+            await generate_traffic(api, args.users, args.updates, args.rate, args.seed)
+            deadline = time.perf_counter() + args.wait
+            while api.stats()['unanswered'] and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+            elapsed = time.perf_counter() - started
+            summary = api.stats()
+            summary['seconds'] = round(elapsed, 2)
+            summary['answered_per_second'] = round(summary['answered'] / elapsed, 1)
+            print(json.dumps(summary, indent=2))
+            if args.exit:
+                return
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--token', default='123:stub', help="token the bot is started with")
+    parser.add_argument('--users', type=int, default=0, help="simulated customers, 0 only serves the API")
+    parser.add_argument('--updates', type=int, default=10, help="updates per customer")
+    parser.add_argument('--rate', type=float, default=500, help="updates per second")
+    parser.add_argument('--wait', type=float, default=60, help="seconds to wait for the last answers")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--exit', action='store_true', help="exit after the traffic was answered")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
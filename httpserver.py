@@ -0,0 +1,131 @@
+import asyncio
+import json
+from typing import Dict, NamedTuple
+
+# Just enough HTTP/1.1 for the webhook and the local health/metrics endpoints,
+# so serving them doesn't pull in a web framework.
+
+MAX_BODY_SIZE = 1 << 20
+KEEP_ALIVE_TIMEOUT = 75
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+# Parsed request handed to a route, header names are lower-case
+class Request(NamedTuple):
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes
+    keep_alive: bool
+
+
+# Response returned by a route
+class Response(NamedTuple):
+    status: int
+    body: bytes = b''
+    content_type: str = 'text/plain; charset=utf-8'
+
+
+# Request that is answered with an error status and then the connection is closed
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+def json_response(status, data):
+    return Response(status, json.dumps(data).encode(), 'application/json')
+
+
+def _encode(response, keep_alive):
+    head = (
+        f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+        f"Content-Type: {response.content_type}\r\n"
+        f"Content-Length: {len(response.body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode('latin-1') + response.body
+
+
+async def _read_request(reader):
+    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+    if not request_line:
+        return None
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400)
+    if length > MAX_BODY_SIZE:
+        raise HTTPError(413)
+    body = await reader.readexactly(length) if length else b''
+
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    return Request(method, target.split('?', 1)[0], headers, body, keep_alive)
+
+
+# Serve `routes`, a dict of (method, path) -> async fn(Request) -> Response
+async def start_server(host, port, routes, max_connections=None):
+    slots = asyncio.Semaphore(max_connections) if max_connections else None
+
+    async def dispatch(request):
+        handler = routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in routes)
+            return Response(405 if known_path else 404)
+        try:
+            return await handler(request)
+        except Exception:
+            return Response(500)
+
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HTTPError as error:
+                    writer.write(_encode(Response(error.status), False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                if slots is not None:
+                    async with slots:
+                        response = await dispatch(request)
+                else:
+                    response = await dispatch(request)
+
+                writer.write(_encode(response, request.keep_alive))
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        # Cancelled covers connections still open when the server's loop shuts down
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_connection, host, port)
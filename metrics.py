@@ -0,0 +1,230 @@
+import bisect
+import functools
+import os
+import threading
+import time
+
+from telegram.ext import ConversationHandler
+
+import startup
+from httpserver import Response, start_server
+
+# Local port serving /metrics in Prometheus text format, 0 turns the exporter off
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+# Every metric created below, in exposition order
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Base of the metric types: a name, a help line and label names.
+# Metrics are updated from the event loop and the database threads, hence the lock.
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+# Monotonic count per label set
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}' for labels, value in values
+        ]
+
+
+# Value read when scraped; `function` returns a number, or {label values: number} with labels
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.function = None
+
+    def set_function(self, function):
+        self.function = function
+
+    def collect(self):
+        if self.function is None:
+            return []
+        values = self.function()
+        if not self.labelnames:
+            values = {(): values}
+        return self.header() + [
+            f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}' for labels, value in values.items()
+        ]
+
+
+# Value read when scraped that only goes up, for totals kept elsewhere
+class CounterFunction(Gauge):
+    kind = 'counter'
+
+
+# Cumulative histogram per label set
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # labels -> [count per bucket, sum, count]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def collect(self):
+        with self._lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+handler_seconds = Histogram('bot_handler_seconds', 'Time spent in each update handler.', ['handler'])
+handler_errors = Counter('bot_handler_errors_total', 'Handlers that raised, by exception type.', ['handler', 'error'])
+db_seconds = Histogram(
+    'bot_db_query_seconds', 'SQLite time per storage operation, on the database thread.',
+    ['operation', 'mode'], DB_BUCKETS
+)
+db_errors = Counter('bot_db_errors_total', 'Storage operations that raised.', ['operation', 'error'])
+db_write_batch = Histogram(
+    'bot_db_write_batch_size', 'Writes committed together in one transaction.', buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+catalog_changes = Counter('bot_catalog_changes_total', 'Committed catalog changes by kind.', ['kind'])
+api_seconds = Histogram('bot_api_request_seconds', 'Bot API request latency, queueing excluded.', ['method'])
+api_errors = Counter('bot_api_errors_total', 'Failed Bot API requests.', ['method', 'error'])
+notifications = Counter('bot_notifications_total', 'New product notifications by outcome.', ['outcome'])
+update_queue = Gauge('bot_update_queue_size', 'Updates fetched but not yet picked up.')
+active_users = Gauge('bot_active_users', 'Users with an update being handled or waiting.')
+outbound_queue = Gauge('bot_outbound_queue_size', 'Bot API requests waiting for the rate limiter.')
+outbound_wait = CounterFunction('bot_outbound_wait_seconds_total', 'Total rate limiter wait by priority.', ['priority'])
+outbound_sent = CounterFunction('bot_outbound_sent_total', 'Requests released by the rate limiter by priority.', ['priority'])
+retry_after = CounterFunction('bot_outbound_retry_after_total', 'RetryAfter responses from the Bot API.')
+startup_seconds = Gauge('bot_startup_phase_seconds', 'Wall time of each startup phase.', ['phase'])
+
+
+# Text exposition of every metric
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def _timed(callback, name):
+    @functools.wraps(callback)
+    async def timed(update, context, *args):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context, *args)
+        except Exception as error:
+            handler_errors.inc(name, type(error).__name__)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+    return timed
+
+
+def _instrument(handlers, router):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            _instrument(handler.entry_points, router)
+            for state_handlers in handler.states.values():
+                _instrument(state_handlers, router)
+            _instrument(handler.fallbacks, router)
+        elif router is not None and handler.callback == router.dispatch:
+            # Timed per route instead
+            continue
+        elif not getattr(handler.callback, 'instrumented', False):
+            handler.callback = _timed(handler.callback, handler.callback.__name__)
+            handler.callback.instrumented = True
+
+
+# Time every registered handler, conversation steps included; call after adding handlers.
+# Callbacks going through a router.CallbackRouter are timed per route handler.
+def instrument_handlers(app, router=None):
+    for handlers in app.handlers.values():
+        _instrument(handlers, router)
+    if router is not None:
+        router.wrap_callbacks(lambda callback, key: _timed(callback, callback.__name__))
+
+
+# Serve /metrics for app, returns the asyncio server or None when disabled
+async def start_metrics_server(app, host=None, port=None):
+    host = METRICS_LISTEN if host is None else host
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+
+    update_queue.set_function(app.update_queue.qsize)
+    startup_seconds.set_function(lambda: {(phase,): seconds for phase, seconds in startup.phases.items()})
+    processor = app.update_processor
+    if hasattr(processor, 'active_keys'):
+        active_users.set_function(lambda: processor.active_keys)
+    limiter = app.bot.rate_limiter
+    if hasattr(limiter, 'metrics'):
+        outbound_queue.set_function(lambda: limiter.metrics()['queue_depth'])
+        outbound_wait.set_function(lambda: {(name,): value for name, value in limiter.metrics()['wait_seconds'].items()})
+        outbound_sent.set_function(lambda: {(name,): value for name, value in limiter.metrics()['sent'].items()})
+        retry_after.set_function(lambda: limiter.metrics()['retry_after'])
+
+    async def serve_metrics(request):
+        return Response(200, render().encode(), 'text/plain; version=0.0.4; charset=utf-8')
+
+    return await start_server(host, port, {('GET', '/metrics'): serve_metrics})
@@ -0,0 +1,61 @@
+from telegram.error import BadRequest
+
+# Edit failures that a new message gets around, anything else would fail the same way again
+UNEDITABLE_ERRORS = (
+    "message to edit not found",
+    "message can't be edited",
+    "there is no text in the message to edit",
+)
+
+
+# Replace the screen a button was pressed on with new content.
+# The message is edited in place, left alone if nothing changed, and only
+# re-sent when it can't be edited (too old, deleted or not a text message).
+# markup_data is reply_markup.to_dict() when the caller already has it.
+async def show_screen(query, context, text, reply_markup=None, parse_mode=None, markup_data=None):
+    message = query.message
+    chat_id = message.chat_id
+    if markup_data is not None:
+        markup = markup_data
+    else:
+        markup = reply_markup.to_dict() if reply_markup else None
+    screen = [message.message_id, text, markup]
+
+    # Last content this chat's screen was drawn with
+    last = context.chat_data.get('screen')
+    if last == screen:
+        return
+
+    if message.text is None:
+        sent = await context.bot.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+        screen[0] = sent.message_id
+        context.chat_data['screen'] = screen
+        return
+
+    try:
+        if last and last[0] == message.message_id and last[1] == text:
+            await context.bot.edit_message_reply_markup(
+                chat_id=chat_id, message_id=message.message_id, reply_markup=reply_markup
+            )
+        else:
+            await context.bot.edit_message_text(
+                text, chat_id=chat_id, message_id=message.message_id,
+                parse_mode=parse_mode, reply_markup=reply_markup
+            )
+    except BadRequest as error:
+        reason = error.message.lower()
+        if any(uneditable in reason for uneditable in UNEDITABLE_ERRORS):
+            sent = await context.bot.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+            screen[0] = sent.message_id
+        elif 'not modified' not in reason:
+            raise
+
+    context.chat_data['screen'] = screen
+
+
+# Show a pre-rendered views.Screen
+async def show_view(query, context, screen):
+    await show_screen(
+        query, context, screen.text,
+        reply_markup=screen.reply_markup, parse_mode=screen.parse_mode, markup_data=screen.markup_data
+    )
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+import metrics
+import storage
+import views
+from ratelimit import PRIORITY_BULK
+
+# Seconds to wait after products were added before notifying, so an admin
+# adding several in a row, or an import, makes one message per subscriber
+NOTIFY_DELAY = float(os.getenv("NOTIFY_DELAY", "60"))
+# Seconds between checks for products added by other processes or before a restart
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", "300"))
+# Subscribers claimed and messaged at a time
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "30"))
+# Products listed per category in one message, the rest are counted
+NOTIFY_MAX_LISTED = int(os.getenv("NOTIFY_MAX_LISTED", "5"))
+
+# Background fan-out of new product notifications to category subscribers.
+# A run covers the products added since the last one; its subscribers are
+# claimed NOTIFY_BATCH_SIZE at a time through a cursor kept in the database,
+# so a restarted bot picks up where it stopped and workers sharing the
+# database split a run instead of repeating it. A claimed batch is sent at most
+# once: users of a batch that was being sent when the bot stopped miss that run.
+# Messages go out at PRIORITY_BULK, behind every interactive reply, and the
+# rate limiter keeps them within Telegram's broadcast limits.
+
+logger = logging.getLogger(__name__)
+
+_wakeup = None
+
+
+# Catalog hook, products were just added in this process
+def items_added():
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _notify(bot, user_id, news):
+    screen = views.new_products_screen(news)
+    try:
+        await bot.send_message(
+            user_id, screen.text, parse_mode=screen.parse_mode, reply_markup=screen.reply_markup,
+            rate_limit_args=PRIORITY_BULK
+        )
+    except Forbidden:
+        # Blocked the bot
+        metrics.notifications.inc('blocked')
+        await storage.unsubscribe_all(user_id)
+        return
+    except BadRequest as error:
+        if 'chat not found' in error.message.lower():
+            metrics.notifications.inc('blocked')
+            await storage.unsubscribe_all(user_id)
+            return
+        metrics.notifications.inc('failed')
+        logger.warning("notifying %d failed: %s", user_id, error)
+        return
+    except TelegramError as error:
+        metrics.notifications.inc('failed')
+        logger.warning("notifying %d failed: %s", user_id, error)
+        return
+    metrics.notifications.inc('sent')
+
+
+# Finish the current run and any started since, batch by batch
+async def fan_out(bot):
+    while True:
+        run = await storage.start_notification_run()
+        if run is None:
+            return
+        news = {category.category: category for category in await storage.new_items_by_category(run, NOTIFY_MAX_LISTED)}
+        while True:
+            subscribers = await storage.claim_subscribers(run, list(news), NOTIFY_BATCH_SIZE)
+            await asyncio.gather(*(
+                _notify(bot, user_id, [news[category] for category in sorted(categories)])
+                for user_id, categories in subscribers
+            ))
+            if len(subscribers) < NOTIFY_BATCH_SIZE:
+                break
+
+
+# Runs until cancelled, started once the bot is initialized
+async def run(bot):
+    global _wakeup
+    _wakeup = asyncio.Event()
+    try:
+        while True:
+            try:
+                await fan_out(bot)
+            except Exception:
+                logger.exception("new product notifications failed")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), NOTIFY_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                continue
+            await asyncio.sleep(NOTIFY_DELAY)
+            _wakeup.clear()
+    finally:
+        _wakeup = None
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import os
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import storage
+
+# Seconds between persistence runs; changes in between are coalesced per user/chat
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+# Keeps user_data, chat_data and ConversationHandler states in items.db.
+# The Application calls the update_* methods for everything that changed since
+# its last run; they only record the new value, and the whole batch is written
+# in a single transaction right after, so a busy bot pays one commit per
+# interval instead of one per update.
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        # (kind, key) -> JSON text, None to delete
+        self._pending = {}
+        self._write_task = None
+
+    def _stage(self, kind, key, data):
+        self._pending[(kind, key)] = None if data is None else json.dumps(data)
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    # Runs as _write_task until the write is done, so flush() can wait for it
+    async def _write_pending(self):
+        # Let the rest of this persistence run stage its changes first
+        await asyncio.sleep(0)
+        changes, self._pending = self._pending, {}
+        try:
+            if changes:
+                await storage.save_state(changes)
+        except Exception:
+            # Keep the batch for the next write, values staged since are newer
+            logger.exception("saving %d bot state changes failed, retrying with the next write", len(changes))
+            changes.update(self._pending)
+            self._pending = changes
+            self._write_task = None
+            return
+        # Changes staged while this batch was written
+        self._write_task = asyncio.create_task(self._write_pending()) if self._pending else None
+
+    async def _load(self, kind):
+        return {int(key): json.loads(data) for key, data in (await storage.load_state(kind)).items()}
+
+    async def get_user_data(self):
+        return await self._load('user_data')
+
+    async def get_chat_data(self):
+        return await self._load('chat_data')
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        saved = await storage.load_state(f'conversation:{name}')
+        return {tuple(json.loads(key)): json.loads(state) for key, state in saved.items()}
+
+    async def update_user_data(self, user_id, data):
+        self._stage('user_data', str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage('chat_data', str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(f'conversation:{name}', json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._stage('user_data', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage('chat_data', str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # Called once on shutdown after the last persistence run
+    async def flush(self):
+        while self._write_task is not None:
+            await self._write_task
+        if self._pending:
+            changes, self._pending = self._pending, {}
+            await storage.save_state(changes)
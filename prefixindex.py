@@ -0,0 +1,236 @@
+import asyncio
+import bisect
+import itertools
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import storage
+from trigrams import TrigramIndex
+
+# Result pages kept for repeated keystrokes, dropped whenever the catalog changes
+MAX_CACHED_RESULTS = int(os.getenv("PREFIX_CACHE_RESULTS", "1024"))
+
+# In-memory word-prefix index over product names for per-keystroke inline search.
+# _tokens is a sorted list of (word, item id) so every word starting with a
+# prefix sits in one contiguous slice found by bisection. The catalog layer
+# keeps it current on single-item writes; bulk writes mark it stale and it is
+# reloaded in the background while the old copy keeps answering.
+# The distinct words are also kept in a trigram index for typo correction.
+_items: Dict[int, Tuple[str, float, str]] = {}
+_tokens: List[Tuple[str, int]] = []
+# item id -> words of its name, to check the other words of a query
+_words: Dict[int, Tuple[str, ...]] = {}
+_fuzzy = TrigramIndex()
+_results = OrderedDict()
+_loaded = False
+_stale = False
+# Bumped on every change so a load that raced with one is redone
+_generation = 0
+_load_task = None
+
+
+class Results(NamedTuple):
+    items: List[Tuple[int, str, float, str]]
+    has_next: bool
+
+
+def tokenize(text):
+    return sorted(set(re.findall(r'\w+', text.lower())))
+
+
+# First key past every word starting with prefix
+def _prefix_end(prefix):
+    return (prefix[:-1] + chr(ord(prefix[-1]) + 1),)
+
+
+def _changed():
+    global _generation
+    _generation += 1
+    _results.clear()
+
+
+# Whether any indexed word starts with prefix
+def _has_prefix(prefix):
+    index = bisect.bisect_left(_tokens, (prefix,))
+    return index < len(_tokens) and _tokens[index][0].startswith(prefix)
+
+
+def _has_word(word):
+    index = bisect.bisect_left(_tokens, (word,))
+    return index < len(_tokens) and _tokens[index][0] == word
+
+
+def _insert(item_id, name, price, category):
+    _items[item_id] = (name, price, category)
+    _words[item_id] = tuple(tokenize(name))
+    for token in _words[item_id]:
+        if not _has_word(token):
+            _fuzzy.add(token)
+        bisect.insort(_tokens, (token, item_id))
+
+
+def _delete(item_id):
+    if _items.pop(item_id, None) is None:
+        return
+    for token in _words.pop(item_id):
+        index = bisect.bisect_left(_tokens, (token, item_id))
+        if index < len(_tokens) and _tokens[index] == (token, item_id):
+            del _tokens[index]
+        if not _has_word(token):
+            _fuzzy.remove(token)
+
+
+# Catalog hooks, applied in place once the index is loaded
+
+def add(item_id, name, price, category):
+    _changed()
+    if _loaded:
+        _insert(item_id, name, price, category)
+
+
+def update(item_id, field, value):
+    _changed()
+    if not _loaded or item_id not in _items:
+        return
+    name, price, category = _items[item_id]
+    if field == 'name':
+        _delete(item_id)
+        _insert(item_id, value, price, category)
+    elif field == 'price':
+        _items[item_id] = (name, value, category)
+    elif field == 'category':
+        _items[item_id] = (name, price, value)
+
+
+def remove(item_id):
+    _changed()
+    if _loaded:
+        _delete(item_id)
+
+
+# Many products changed at once, reload from the database on next use
+def mark_stale():
+    global _stale
+    _changed()
+    _stale = True
+
+
+# Drop the index, for instance after switching to another database
+def reset():
+    global _items, _tokens, _words, _fuzzy, _loaded, _stale
+    _changed()
+    _items, _tokens, _words, _fuzzy = {}, [], {}, TrigramIndex()
+    _loaded = _stale = False
+
+
+async def _load():
+    global _items, _tokens, _words, _fuzzy, _loaded, _stale, _load_task
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            generation = _generation
+            items, tokens, words = {}, [], {}
+
+            # Runs on a database reader thread, batch by batch
+            def collect(rows):
+                for item_id, name, price, category in rows:
+                    items[item_id] = (name, price, category)
+                    words[item_id] = tuple(tokenize(name))
+                    tokens.extend((token, item_id) for token in words[item_id])
+
+            await storage.export_items(collect)
+            await loop.run_in_executor(None, tokens.sort)
+            fuzzy = await loop.run_in_executor(
+                None, TrigramIndex, (word for word, _ in itertools.groupby(token for token, _ in tokens))
+            )
+            if generation == _generation:
+                _items, _tokens, _words, _fuzzy = items, tokens, words, fuzzy
+                _loaded = True
+                _stale = False
+                _results.clear()
+                return
+    finally:
+        _load_task = None
+
+
+# Load the index if needed; waits only when there is nothing to answer from yet
+async def ensure_loaded():
+    global _load_task
+    if _loaded and not _stale:
+        return
+    if _load_task is None:
+        _load_task = asyncio.create_task(_load())
+    if not _loaded:
+        await asyncio.shield(_load_task)
+
+
+# Up to limit + 1 matching ids from offset on
+def _matches(words, offset, limit):
+    if not words:
+        return list(itertools.islice(_items, offset, offset + limit + 1))
+
+    # Walk the narrowest word's slice, the other words must prefix some word of the name
+    ranges = []
+    for word in words:
+        start = bisect.bisect_left(_tokens, (word,))
+        end = bisect.bisect_left(_tokens, _prefix_end(word), start)
+        ranges.append((end - start, start, end, word))
+    ranges.sort()
+    _, start, end, _ = ranges[0]
+    others = [word for _, _, _, word in ranges[1:]]
+
+    found = []
+    seen = set()
+    skipped = 0
+    for index in range(start, end):
+        item_id = _tokens[index][1]
+        if item_id in seen:
+            continue
+        seen.add(item_id)
+        if others:
+            name_words = _words[item_id]
+            if not all(any(token.startswith(word) for token in name_words) for word in others):
+                continue
+        if skipped < offset:
+            skipped += 1
+            continue
+        found.append(item_id)
+        if len(found) > limit:
+            break
+    return found
+
+
+# Products whose name has a word starting with each word of the query
+async def search(query, offset=0, limit=20) -> Results:
+    await ensure_loaded()
+    words = tokenize(query)
+    key = (tuple(words), offset, limit)
+    results = _results.get(key)
+    if results is not None:
+        _results.move_to_end(key)
+        return results
+
+    found = _matches(words, offset, limit)
+    results = Results(
+        [(item_id,) + _items[item_id] for item_id in found[:limit]],
+        len(found) > limit,
+    )
+    _results[key] = results
+    if len(_results) > MAX_CACHED_RESULTS:
+        _results.popitem(last=False)
+    return results
+
+
+# The query with every word no product name has a word starting with replaced
+# by the closest indexed word, None when nothing needed or could be corrected
+async def suggest(query) -> Optional[str]:
+    await ensure_loaded()
+    words = re.findall(r'\w+', query.lower())
+    corrected = []
+    for word in words:
+        if not _has_prefix(word):
+            word = _fuzzy.closest(word) or word
+        corrected.append(word)
+    return ' '.join(corrected) if corrected != words else None
@@ -0,0 +1,72 @@
+import asyncio
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# How many updates may run handlers at the same time
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+# Updates admitted at once, running or waiting for their user's turn and a
+# slot. This is no backpressure on fetching: further updates still queue up in
+# the Application, waiting to be admitted
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "4096"))
+# "user" or "chat": whose updates must be handled one at a time
+SERIALIZE_BY = os.getenv("UPDATE_SERIALIZE_BY", "user")
+
+
+# Processes updates of different users concurrently but each user's updates
+# strictly in arrival order, so conversation state and user_data are never raced.
+# The per-user lock is taken before a concurrency slot, otherwise one busy user
+# queueing many updates would hold every slot while waiting on their own lock.
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=UPDATE_CONCURRENCY, serialize_by=SERIALIZE_BY):
+        super().__init__(max(MAX_PENDING_UPDATES, max_concurrent_updates))
+        self.concurrency = max_concurrent_updates
+        self.serialize_by = serialize_by
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+
+    def _key(self, update):
+        if not isinstance(update, Update):
+            return None
+        user = update.effective_user
+        chat = update.effective_chat
+        if self.serialize_by == 'chat' and chat is not None:
+            return ('chat', chat.id)
+        if user is not None:
+            return ('user', user.id)
+        if chat is not None:
+            return ('chat', chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    # Users with an update in flight or queued
+    @property
+    def active_keys(self):
+        return len(self._locks)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,194 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import os
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+# Lower number goes first, passed to bot methods as rate_limit_args
+PRIORITY_INTERACTIVE = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_ADMIN: 'admin', PRIORITY_BULK: 'bulk'}
+
+# Bot API limits: ~30 messages/s overall, ~1/s per private chat, 20/min per group
+GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))
+GROUP_BURST = float(os.getenv("OUTBOUND_GROUP_BURST", "20"))
+MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Idle per-chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 1024
+
+
+# Classic token bucket refilled continuously at `rate` tokens per second
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until a token is available without taking it
+    def delay(self):
+        self._refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    # Take a token now, possibly going into debt, and return how long to wait for it
+    def reserve(self):
+        self.take()
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+# Outbound scheduler in front of every Bot API call.
+# Each request first waits on its chat's bucket, then queues for a global
+# token; the queue hands tokens out by priority so interactive replies
+# overtake bulk and admin sends. A RetryAfter pauses everything for the
+# requested time and the request is retried.
+class OutboundScheduler(BaseRateLimiter):
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 group_rate=GROUP_RATE, group_burst=GROUP_BURST, max_retries=MAX_RETRIES):
+        # A bucket holding less than one token would never send
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = max(chat_burst, 1)
+        self.group_rate = group_rate
+        self.group_burst = max(group_burst, 1)
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self.paused_until = 0.0
+
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._pump_task = None
+
+        # Metrics
+        self.queue_depth = 0
+        self.sent = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.max_wait_seconds = 0.0
+        self.retry_after_count = 0
+
+    # Called by both the Application and its Updater, only the first call starts the pump
+    async def initialize(self):
+        if self._pump_task is None:
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.create_task(self._pump())
+
+    async def shutdown(self):
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._pump_task
+            self._pump_task = None
+
+    def metrics(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'sent': dict(self.sent),
+            'wait_seconds': dict(self.wait_seconds),
+            'max_wait_seconds': self.max_wait_seconds,
+            'retry_after': self.retry_after_count,
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                for key in [key for key, idle in self.chat_buckets.items() if idle.is_full()]:
+                    del self.chat_buckets[key]
+            # Negative ids and @usernames are groups and channels
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    # Hand out global tokens to queued requests, highest priority first
+    async def _pump(self):
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = max(self.paused_until - time.monotonic(), self.global_bucket.delay())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                self.global_bucket.take()
+                future.set_result(None)
+
+    async def _acquire(self, priority, chat_id):
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args or PRIORITY_INTERACTIVE
+        name = PRIORITY_NAMES.get(priority, 'bulk')
+
+        chat_id = data.get('chat_id')
+        if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+            chat_id = int(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            self.queue_depth += 1
+            try:
+                await self._acquire(priority, chat_id)
+            finally:
+                self.queue_depth -= 1
+
+            waited = time.monotonic() - started
+            self.wait_seconds[name] += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.sent[name] += 1
+
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except Exception as error:
+                metrics.api_errors.inc(endpoint, type(error).__name__)
+                if not isinstance(error, RetryAfter):
+                    raise
+                self.retry_after_count += 1
+                if attempt == self.max_retries:
+                    raise
+                self.paused_until = max(self.paused_until, time.monotonic() + error.retry_after + 0.1)
+            finally:
+                metrics.api_seconds.observe(time.perf_counter() - started, endpoint)
@@ -0,0 +1,101 @@
+class _Route:
+    __slots__ = ('key', 'callback', 'parse')
+
+    def __init__(self, key, callback, parse):
+        self.key = key
+        self.callback = callback
+        self.parse = parse
+
+
+# Routes callback_data to handlers. Fixed values are looked up in a dict;
+# parameterised ones by walking a prefix trie, where the longest registered
+# prefix wins, so 'edit_field_' is never shadowed by 'edit_' whatever the
+# registration order. Prefix routes get the rest of the data through their
+# parser as a third argument.
+class CallbackRouter:
+    def __init__(self):
+        self._exact = {}
+        # char -> child node, the route ending at a node is stored under None
+        self._trie = {}
+        self._unmatched = None
+
+    # Called as callback(update, context) for data no route accepts, such as
+    # buttons from an older callback format; the query is not answered for it
+    def unmatched(self, callback):
+        self._unmatched = callback
+
+    def exact(self, data, callback):
+        self._exact[data] = _Route(data, callback, None)
+
+    def prefix(self, prefix, callback, parse=str):
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = _Route(prefix, callback, parse)
+
+    # (route, remaining data) for callback data, None if nothing matches
+    def resolve(self, data):
+        route = self._exact.get(data)
+        if route is not None:
+            return route, None
+
+        found = None
+        node = self._trie
+        for index, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], data[index + 1:])
+        return found
+
+    def routes(self):
+        yield from self._exact.values()
+        stack = [self._trie]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    yield child
+                else:
+                    stack.append(child)
+
+    # Replace every route callback with wrap(callback, route key)
+    def wrap_callbacks(self, wrap):
+        for route in self.routes():
+            route.callback = wrap(route.callback, route.key)
+
+    # CallbackQueryHandler pattern matching the given route keys only,
+    # lets ConversationHandlers share this router's dispatch
+    def pattern(self, *keys):
+        keys = set(keys)
+
+        def matches(data):
+            found = isinstance(data, str) and self.resolve(data)
+            return bool(found) and found[0].key in keys
+
+        return matches
+
+    # Single entry point for callback queries: parse, answer once, call the route.
+    # Returns the route's result, which is the next state inside a conversation.
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        found = self.resolve(query.data or '')
+        payload = None
+        if found is not None and found[0].parse is not None:
+            try:
+                payload = found[0].parse(found[1])
+            except ValueError:
+                found = None
+
+        if found is None:
+            if self._unmatched is not None:
+                return await self._unmatched(update, context)
+            await query.answer()
+            return None
+
+        await query.answer()
+        route = found[0]
+        if route.parse is None:
+            return await route.callback(update, context)
+        return await route.callback(update, context, payload)
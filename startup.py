@@ -0,0 +1,31 @@
+import logging
+import time
+
+# Wall time of each startup phase, logged once the bot is ready and exposed as
+# bot_startup_phase_seconds. Phases are consecutive: each mark() closes the
+# one running since the previous mark, so together they add up to the time
+# until the first update is taken.
+phases = {}
+_started = _last = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+def mark(phase):
+    global _last
+    now = time.perf_counter()
+    phases[phase] = now - _last
+    _last = now
+
+
+# A phase running alongside the others, like loading an index in the background
+def record(phase, seconds):
+    phases[phase] = seconds
+
+
+def report():
+    logger.info(
+        "started in %.0f ms: %s",
+        (_last - _started) * 1000,
+        ', '.join(f'{phase} {seconds * 1000:.0f} ms' for phase, seconds in phases.items()),
+    )
@@ -0,0 +1,869 @@
+import asyncio
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import metrics
+
+DB_PATH = os.getenv("ITEMS_DB", "items.db")
+READER_POOL_SIZE = int(os.getenv("ITEMS_DB_READERS", "4"))
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "10"))
+# Longest a write waits for others to share its transaction, and most writes per transaction
+WRITE_BATCH_WINDOW = float(os.getenv("WRITE_BATCH_WINDOW", "0.002"))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "64"))
+
+DEFAULT_CATEGORIES = ['Electronics', 'Clothing', 'Food', 'Books', 'Furniture']
+
+# Columns an admin is allowed to change from the edit flow
+EDITABLE_FIELDS = ('name', 'price', 'category', 'photo_file_id')
+
+# Keyset (expression, row index) pairs for each browse order, the last one is always the unique id.
+# Expressions match the migration indexes so pages are read straight off an index.
+PAGE_ORDERS = {
+    'id': (('id', 0),),
+    'name': (('name COLLATE NOCASE', 1), ('id', 0)),
+    'price': (('price', 2), ('id', 0)),
+    'price_desc': (('price', 2), ('id', 0)),
+}
+# Orders read from the end of their index backwards
+DESCENDING_ORDERS = {'price_desc'}
+
+# Bounds between the price ranges offered when browsing by price, ascending
+PRICE_BUCKET_BOUNDS = [float(bound) for bound in os.getenv("PRICE_BUCKETS", "500,2000").split(',')]
+# (min price, max price) of each range, None where unbounded; min is inclusive, max exclusive
+PRICE_BUCKETS = list(zip([None] + PRICE_BUCKET_BOUNDS, PRICE_BUCKET_BOUNDS + [None]))
+
+
+# One page of (id, name, price, category) rows
+class Page(NamedTuple):
+    items: List[Tuple[int, str, float, str]]
+    has_prev: bool
+    has_next: bool
+
+
+# Products added to one category during a notification run, see new_items_by_category()
+class CategoryNews(NamedTuple):
+    category_id: int
+    category: str
+    count: int
+    items: List[Tuple[int, str, float]]
+
+
+# A committed change to items or categories, see on_change(). kind is one of
+# item_added, item_updated, item_deleted, category_added and items_imported;
+# row_id is the product or category id, values the columns it was written with
+# (and the inserted/updated counts of an import).
+class Change(NamedTuple):
+    kind: str
+    row_id: Optional[int]
+    values: Dict[str, Any]
+
+
+# A notification run covers the products with after_id < id <= up_to_id
+class NotificationRun(NamedTuple):
+    after_id: int
+    up_to_id: int
+
+
+# One writer thread owns the only write connection, readers get one connection per pool thread
+_writer_thread = None
+_write_queue = None
+_reader_executor = None
+_writer_conn = None
+_reader_conns = []
+_reader_lock = threading.Lock()
+_local = threading.local()
+# Catalog version this process is up to date with, see catalog_changed_elsewhere()
+_catalog_version = None
+
+
+# Open a long-lived connection tuned for concurrent readers and a single writer
+def _connect(read_only=False):
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+# Reader connection bound to the current pool thread
+def _reader_conn():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect(read_only=True)
+        _local.conn = conn
+        with _reader_lock:
+            _reader_conns.append(conn)
+    return conn
+
+
+# Time fn on the database thread, labelled with the storage function it belongs to
+def _timed(fn, mode, run):
+    operation = fn.__qualname__.split('.')[0]
+    started = time.perf_counter()
+    try:
+        return run()
+    except Exception as error:
+        metrics.db_errors.inc(operation, type(error).__name__)
+        raise
+    finally:
+        metrics.db_seconds.observe(time.perf_counter() - started, operation, mode)
+
+
+# Run a read-only function on the reader pool
+async def _read(fn, *args):
+    def run():
+        return _timed(fn, 'read', lambda: fn(_reader_conn(), *args))
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_reader_executor, run)
+
+
+# Functions called with every committed Change, on the event loop of the write
+# that made it and before that write's caller resumes
+_change_listeners: List[Callable[[Change], None]] = []
+# Changes recorded by the write running on the writer thread
+_pending_changes: List[Change] = []
+
+
+def on_change(listener: Callable[[Change], None]) -> None:
+    _change_listeners.append(listener)
+
+
+class _WriteOp:
+    __slots__ = ('fn', 'args', 'loop', 'future')
+
+    def __init__(self, fn, args, loop, future):
+        self.fn = fn
+        self.args = args
+        self.loop = loop
+        self.future = future
+
+
+# Runs on the op's event loop once its transaction is over
+def _settle(op, error, result, changes):
+    try:
+        for change in changes:
+            for listener in _change_listeners:
+                listener(change)
+    finally:
+        if not op.future.done():
+            if error is not None:
+                op.future.set_exception(error)
+            else:
+                op.future.set_result(result)
+
+
+# Run a batch of writes in one transaction, each inside its own savepoint so a
+# failing write is rolled back alone and its caller gets the exception.
+# IMMEDIATE takes the write lock up front: with other processes writing to the
+# same file a deferred transaction could fail on its stale read snapshot instead
+# of waiting out the busy timeout.
+def _run_batch(batch):
+    outcomes = []
+    try:
+        _writer_conn.execute("BEGIN IMMEDIATE")
+        try:
+            for op in batch:
+                _pending_changes.clear()
+                _writer_conn.execute("SAVEPOINT write_op")
+                try:
+                    result = _timed(op.fn, 'write', lambda: op.fn(_writer_conn, *op.args))
+                except Exception as error:
+                    _writer_conn.execute("ROLLBACK TO write_op")
+                    _writer_conn.execute("RELEASE write_op")
+                    outcomes.append((error, None, []))
+                else:
+                    _writer_conn.execute("RELEASE write_op")
+                    outcomes.append((None, result, list(_pending_changes)))
+            started = time.perf_counter()
+            _writer_conn.commit()
+            metrics.db_seconds.observe(time.perf_counter() - started, 'commit', 'write')
+        except Exception:
+            _writer_conn.rollback()
+            raise
+    except Exception as error:
+        # BEGIN or COMMIT failed, for instance on the busy timeout, and nothing was written
+        metrics.db_errors.inc('commit', type(error).__name__)
+        outcomes = [(error, None, [])] * len(batch)
+    metrics.db_write_batch.observe(len(batch))
+
+    for op, (error, result, changes) in zip(batch, outcomes):
+        try:
+            op.loop.call_soon_threadsafe(_settle, op, error, result, changes)
+        except RuntimeError:
+            # The caller's event loop is gone
+            pass
+
+
+# Group commit: the first queued write waits up to WRITE_BATCH_WINDOW for
+# others, and every write queued by then shares one transaction and one fsync.
+# A None in the queue stops the thread once the writes before it are done.
+def _writer_main():
+    stopping = False
+    while not stopping:
+        op = _write_queue.get()
+        if op is None:
+            return
+        batch = [op]
+        deadline = time.monotonic() + WRITE_BATCH_WINDOW
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                op = _write_queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if op is None:
+                stopping = True
+                break
+            batch.append(op)
+        _run_batch(batch)
+
+
+# Run a function inside a write transaction on the writer thread, possibly
+# sharing it with other writes; its changes are published before this returns
+async def _write(fn, *args):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _write_queue.put(_WriteOp(fn, args, loop, future))
+    return await future
+
+
+# Schema migrations in order, PRAGMA user_version records how many have been applied.
+# Never edit a released step, append a new one instead.
+MIGRATIONS = [
+    # 1: items and categories, same as databases created before versioning
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            category TEXT NOT NULL,
+            added_date TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+        ''',
+    ],
+    # 2: full-text index over product names and categories, kept in sync by triggers
+    [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            name, category,
+            content='items', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+            INSERT INTO items_fts (rowid, name, category) VALUES (new.id, new.name, new.category);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, category) VALUES ('delete', old.id, old.name, old.category);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF name, category ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, category) VALUES ('delete', old.id, old.name, old.category);
+            INSERT INTO items_fts (rowid, name, category) VALUES (new.id, new.name, new.category);
+        END
+        ''',
+        "INSERT INTO items_fts (items_fts) VALUES ('rebuild')",
+    ],
+    # 3: covering indexes for the A-Z and category browse pages and the per-category stats
+    [
+        "CREATE INDEX IF NOT EXISTS idx_items_name_nocase ON items (name COLLATE NOCASE, id, price, category)",
+        "CREATE INDEX IF NOT EXISTS idx_items_category_name ON items (category, name COLLATE NOCASE, id, price)",
+        "ANALYZE items",
+    ],
+    # 4: store statistics maintained by triggers, so the admin screens never aggregate items
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS category_stats (
+            category TEXT PRIMARY KEY,
+            item_count INTEGER NOT NULL,
+            total_value REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS store_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            item_count INTEGER NOT NULL,
+            total_value REAL NOT NULL
+        )
+        ''',
+        "DELETE FROM category_stats",
+        "INSERT INTO category_stats SELECT category, COUNT(*), SUM(price) FROM items GROUP BY category",
+        "INSERT OR REPLACE INTO store_totals SELECT 1, COUNT(*), COALESCE(SUM(price), 0) FROM items",
+        '''
+        CREATE TRIGGER IF NOT EXISTS items_stats_insert AFTER INSERT ON items BEGIN
+            INSERT INTO category_stats (category, item_count, total_value) VALUES (new.category, 1, new.price)
+                ON CONFLICT (category) DO UPDATE SET item_count = item_count + 1, total_value = total_value + new.price;
+            UPDATE store_totals SET item_count = item_count + 1, total_value = total_value + new.price;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS items_stats_delete AFTER DELETE ON items BEGIN
+            UPDATE category_stats SET item_count = item_count - 1, total_value = total_value - old.price
+                WHERE category = old.category;
+            DELETE FROM category_stats WHERE category = old.category AND item_count <= 0;
+            UPDATE store_totals SET item_count = item_count - 1,
+                total_value = CASE WHEN item_count <= 1 THEN 0 ELSE total_value - old.price END;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS items_stats_update AFTER UPDATE OF price, category ON items BEGIN
+            UPDATE category_stats SET item_count = item_count - 1, total_value = total_value - old.price
+                WHERE category = old.category;
+            DELETE FROM category_stats WHERE category = old.category AND item_count <= 0;
+            INSERT INTO category_stats (category, item_count, total_value) VALUES (new.category, 1, new.price)
+                ON CONFLICT (category) DO UPDATE SET item_count = item_count + 1, total_value = total_value + new.price;
+            UPDATE store_totals SET total_value = total_value - old.price + new.price;
+        END
+        ''',
+    ],
+    # 5: user_data, chat_data and conversation states saved by persistence.py, as JSON
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 6: covering indexes for the by-price browse pages, whole catalog and per category
+    [
+        "CREATE INDEX IF NOT EXISTS idx_items_price ON items (price, id, name, category)",
+        "CREATE INDEX IF NOT EXISTS idx_items_category_price ON items (category, price, id, name)",
+        "ANALYZE items",
+    ],
+    # 7: counter of catalog writes, how processes sharing the database notice each other's changes
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)",
+    ],
+    # 8: default categories, seeded once here instead of on every start
+    [
+        "INSERT OR IGNORE INTO categories (name) VALUES "
+        + ", ".join(f"('{category}')" for category in DEFAULT_CATEGORIES),
+        "UPDATE catalog_version SET version = version + 1",
+    ],
+    # 9: category subscriptions and the position of the new product notifications,
+    # run_up_to_id is NULL between runs; only products added from now on are announced
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            PRIMARY KEY (user_id, category)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS notification_cursor (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            notified_id INTEGER NOT NULL,
+            run_up_to_id INTEGER,
+            user_cursor INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO notification_cursor SELECT 1, COALESCE(MAX(id), 0), NULL, 0 FROM items",
+    ],
+    # 10: optional product photo, the Telegram file_id it is sent by
+    [
+        "ALTER TABLE items ADD COLUMN photo_file_id TEXT",
+    ],
+]
+
+
+# Bring the schema up to date, one transaction per migration. An up to date
+# database costs one PRAGMA read; otherwise the version is read again under the
+# write lock since other processes may be migrating the same file.
+def migrate(conn):
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0] + 1
+            if version > len(MIGRATIONS):
+                conn.rollback()
+                return
+            for statement in MIGRATIONS[version - 1]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+# Create the schema and open the shared connections
+def init_db():
+    global _writer_conn, _writer_thread, _write_queue, _reader_executor, _catalog_version
+    if _writer_conn is not None:
+        return
+
+    _writer_conn = _connect()
+    _reader_executor = ThreadPoolExecutor(max_workers=READER_POOL_SIZE, thread_name_prefix='db-reader')
+
+    migrate(_writer_conn)
+    _catalog_version = _writer_conn.execute("SELECT version FROM catalog_version").fetchone()[0]
+
+    _write_queue = queue.SimpleQueue()
+    _writer_thread = threading.Thread(target=_writer_main, name='db-writer', daemon=True)
+    _writer_thread.start()
+
+
+# Close every shared connection once queued writes are committed, called once on shutdown
+def close_db():
+    global _writer_conn, _writer_thread, _write_queue, _reader_executor
+    if _writer_conn is None:
+        return
+
+    _reader_executor.shutdown(wait=True)
+    _write_queue.put(None)
+    _writer_thread.join()
+    with _reader_lock:
+        for conn in _reader_conns:
+            conn.close()
+        _reader_conns.clear()
+    _writer_conn.close()
+    _writer_conn = _writer_thread = _write_queue = _reader_executor = None
+
+
+# Record a change to items or categories, inside the writing transaction; it is
+# published to on_change() listeners once committed. When no other process
+# wrote since we last looked, this process stays up to date.
+def _catalog_changed(conn, change):
+    global _catalog_version
+    _pending_changes.append(change)
+    conn.execute("UPDATE catalog_version SET version = version + 1")
+    version = conn.execute("SELECT version FROM catalog_version").fetchone()[0]
+    if _catalog_version == version - 1:
+        _catalog_version = version
+
+
+# Whether another process changed items or categories since the last call
+async def catalog_changed_elsewhere() -> bool:
+    def query(conn):
+        global _catalog_version
+        version = conn.execute("SELECT version FROM catalog_version").fetchone()[0]
+        changed = version != _catalog_version
+        _catalog_version = version
+        return changed
+
+    return await _read(query)
+
+
+# Get all categories from database
+async def get_categories() -> List[str]:
+    def query(conn):
+        return [row[0] for row in conn.execute("SELECT name FROM categories ORDER BY name")]
+
+    return await _read(query)
+
+
+# All categories as (id, name), ordered by name
+async def get_category_rows() -> List[Tuple[int, str]]:
+    def query(conn):
+        return conn.execute("SELECT id, name FROM categories ORDER BY name").fetchall()
+
+    return await _read(query)
+
+
+# Add a new category and return its id, None if it already exists
+async def add_category(category_name: str) -> Optional[int]:
+    def query(conn):
+        try:
+            category_id = conn.execute("INSERT INTO categories (name) VALUES (?)", (category_name,)).lastrowid
+        except sqlite3.IntegrityError:
+            return None
+        _catalog_changed(conn, Change('category_added', category_id, {'name': category_name}))
+        return category_id
+
+    return await _write(query)
+
+
+# Insert a product and return its id
+async def add_item(name: str, price: float, category: str, photo_file_id: Optional[str] = None) -> int:
+    def query(conn):
+        cursor = conn.execute(
+            "INSERT INTO items (name, price, category, added_date, photo_file_id) VALUES (?, ?, ?, ?, ?)",
+            (name, price, category, datetime.now().isoformat(), photo_file_id)
+        )
+        _catalog_changed(conn, Change('item_added', cursor.lastrowid, {
+            'name': name, 'price': price, 'category': category, 'photo_file_id': photo_file_id,
+        }))
+        return cursor.lastrowid
+
+    return await _write(query)
+
+
+# Get (name, price, category) of one product
+async def get_item(item_id: int) -> Optional[Tuple[str, float, str]]:
+    def query(conn):
+        return conn.execute(
+            "SELECT name, price, category FROM items WHERE id = ?", (item_id,)
+        ).fetchone()
+
+    return await _read(query)
+
+
+# {item id: photo file_id} of the given products that have a photo
+async def get_photos(item_ids: List[int]) -> Dict[int, str]:
+    def query(conn):
+        return dict(conn.execute(
+            "SELECT id, photo_file_id FROM items "
+            "WHERE id IN (SELECT value FROM json_each(?)) AND photo_file_id IS NOT NULL",
+            (json.dumps(item_ids),)
+        ))
+
+    return await _read(query)
+
+
+# Change a single column of a product
+async def update_item_field(item_id: int, field: str, value) -> bool:
+    if field not in EDITABLE_FIELDS:
+        raise ValueError(f"Field '{field}' cannot be edited")
+
+    def query(conn):
+        cursor = conn.execute(f"UPDATE items SET {field} = ? WHERE id = ?", (value, item_id))
+        if cursor.rowcount:
+            _catalog_changed(conn, Change('item_updated', item_id, {field: value}))
+        return cursor.rowcount > 0
+
+    return await _write(query)
+
+
+# Delete a product, False if it was already gone
+async def delete_item(item_id: int) -> bool:
+    def query(conn):
+        deleted = conn.execute("DELETE FROM items WHERE id = ?", (item_id,)).rowcount > 0
+        if deleted:
+            _catalog_changed(conn, Change('item_deleted', item_id, {}))
+        return deleted
+
+    return await _write(query)
+
+
+# Rows strictly after (>) or before (<) a keyset position, nearest first
+def _seek(conn, columns, filters, params, op, key, limit):
+    where = list(filters)
+    args = list(params)
+    if key is not None:
+        # SQLite won't seek an index on a row value with COLLATE, the redundant leading bound lets it
+        if len(columns) > 1:
+            where.append(f"{columns[0]} {op}= ?")
+            args.append(key[0])
+        where.append(f"({', '.join(columns)}) {op} ({', '.join('?' for _ in columns)})")
+        args.extend(key)
+
+    direction = 'DESC' if op == '<' else 'ASC'
+    sql = "SELECT id, name, price, category FROM items"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY " + ", ".join(f"{column} {direction}" for column in columns) + " LIMIT ?"
+    return conn.execute(sql, args + [limit]).fetchall()
+
+
+# Insert or update products by name (case-insensitive) in one transaction.
+# rows are (name, price, category); missing categories are created, and when
+# a name repeats in the batch the last row wins. Returns (inserted, updated).
+async def upsert_items(rows: List[Tuple[str, float, str]]) -> Tuple[int, int]:
+    def query(conn):
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_rows "
+            "(name TEXT PRIMARY KEY COLLATE NOCASE, price REAL NOT NULL, category TEXT NOT NULL)"
+        )
+        conn.execute("DELETE FROM import_rows")
+        conn.executemany("INSERT OR REPLACE INTO import_rows (name, price, category) VALUES (?, ?, ?)", rows)
+        conn.execute("INSERT OR IGNORE INTO categories (name) SELECT DISTINCT category FROM import_rows")
+        updated = conn.execute(
+            """
+            UPDATE items SET price = import_rows.price, category = import_rows.category
+            FROM import_rows
+            WHERE items.name = import_rows.name COLLATE NOCASE
+              AND (items.price != import_rows.price OR items.category != import_rows.category)
+            """
+        ).rowcount
+        inserted = conn.execute(
+            """
+            INSERT INTO items (name, price, category, added_date)
+            SELECT name, price, category, ? FROM import_rows
+            WHERE NOT EXISTS (SELECT 1 FROM items WHERE items.name = import_rows.name COLLATE NOCASE)
+            """,
+            (datetime.now().isoformat(),)
+        ).rowcount
+        conn.execute("DELETE FROM import_rows")
+        _catalog_changed(conn, Change('items_imported', None, {'inserted': inserted, 'updated': updated}))
+        return inserted, updated
+
+    return await _write(query)
+
+
+# Stream every product as (id, name, price, category) in id order to write_rows,
+# batch_size rows at a time; runs on a reader thread so write_rows must be blocking code.
+async def export_items(write_rows, batch_size: int = 1000) -> int:
+    def query(conn):
+        cursor = conn.execute("SELECT id, name, price, category FROM items ORDER BY id")
+        count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return count
+            write_rows(rows)
+            count += len(rows)
+
+    return await _read(query)
+
+
+# Keyset-paginated products, starting after or ending before the product with the given id,
+# optionally limited to a category and a price range (min inclusive, max exclusive)
+async def items_page(order: str = 'id', category: Optional[str] = None, after: Optional[int] = None,
+                     before: Optional[int] = None, limit: int = PAGE_SIZE, min_price: Optional[float] = None,
+                     max_price: Optional[float] = None) -> Page:
+    columns = [expression for expression, _ in PAGE_ORDERS[order]]
+    forward, backward = ('<', '>') if order in DESCENDING_ORDERS else ('>', '<')
+
+    def row_key(row):
+        return tuple(row[index] for _, index in PAGE_ORDERS[order])
+
+    def query(conn):
+        filters, params = [], []
+        if category is not None:
+            filters.append("category = ?")
+            params.append(category)
+        if min_price is not None:
+            filters.append("price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            filters.append("price < ?")
+            params.append(max_price)
+
+        # The anchor may have been deleted since the button was drawn, then start over
+        anchor_id = before if before is not None else after
+        anchor = None
+        if anchor_id is not None:
+            anchor = conn.execute(
+                f"SELECT {', '.join(columns)} FROM items WHERE id = ?", (anchor_id,)
+            ).fetchone()
+
+        if anchor is not None and before is not None:
+            rows = _seek(conn, columns, filters, params, backward, anchor, limit + 1)
+            has_prev = len(rows) > limit
+            rows = rows[:limit][::-1]
+            if not rows:
+                return query_first(conn, filters, params)
+            has_next = bool(_seek(conn, columns, filters, params, forward, row_key(rows[-1]), 1))
+            return Page(rows, has_prev, has_next)
+
+        rows = _seek(conn, columns, filters, params, forward, anchor, limit + 1)
+        if not rows and anchor is not None:
+            return query_first(conn, filters, params)
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        has_prev = bool(rows) and bool(_seek(conn, columns, filters, params, backward, row_key(rows[0]), 1))
+        return Page(rows, has_prev, has_next)
+
+    def query_first(conn, filters, params):
+        rows = _seek(conn, columns, filters, params, forward, None, limit + 1)
+        return Page(rows[:limit], False, len(rows) > limit)
+
+    return await _read(query)
+
+
+# Turn free text into an FTS5 query where every word is a prefix match ("iph" finds "iPhone")
+def fts_query(term):
+    words = re.findall(r'\w+', term.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# BM25-ranked products matching the search term, name matches weigh more than category matches
+async def search_items(term: str, offset: int = 0, limit: int = PAGE_SIZE) -> Page:
+    match = fts_query(term)
+    if not match:
+        return Page([], False, False)
+
+    def query(conn):
+        rows = conn.execute(
+            """
+            SELECT items.id, items.name, items.price, items.category
+            FROM items_fts JOIN items ON items.id = items_fts.rowid
+            WHERE items_fts MATCH ?
+            ORDER BY bm25(items_fts, 10.0, 1.0), items.id
+            LIMIT ? OFFSET ?
+            """,
+            (match, limit + 1, offset)
+        ).fetchall()
+        return Page(rows[:limit], offset > 0, len(rows) > limit)
+
+    return await _read(query)
+
+
+# Product and category counts shown on the admin panel
+async def get_overview() -> Tuple[int, int]:
+    def query(conn):
+        return conn.execute(
+            "SELECT item_count, (SELECT COUNT(*) FROM category_stats) FROM store_totals"
+        ).fetchone()
+
+    return await _read(query)
+
+
+# Totals, average price and per-category counts for the statistics screen
+async def get_stats() -> Tuple[int, int, float, float, List[Tuple[str, int]]]:
+    def query(conn):
+        total_items, total_value = conn.execute(
+            "SELECT item_count, total_value FROM store_totals"
+        ).fetchone()
+        per_category = conn.execute(
+            "SELECT category, item_count FROM category_stats ORDER BY category"
+        ).fetchall()
+        average_value = total_value / total_items if total_items else 0
+        return total_items, len(per_category), total_value, average_value, per_category
+
+    return await _read(query)
+
+
+# Whether a user gets notified of new products in a category
+async def is_subscribed(user_id: int, category: str) -> bool:
+    def query(conn):
+        return conn.execute(
+            "SELECT 1 FROM subscriptions WHERE user_id = ? AND category = ?", (user_id, category)
+        ).fetchone() is not None
+
+    return await _read(query)
+
+
+async def set_subscription(user_id: int, category: str, subscribed: bool) -> None:
+    def query(conn):
+        if subscribed:
+            conn.execute("INSERT OR IGNORE INTO subscriptions (user_id, category) VALUES (?, ?)", (user_id, category))
+        else:
+            conn.execute("DELETE FROM subscriptions WHERE user_id = ? AND category = ?", (user_id, category))
+
+    await _write(query)
+
+
+# Drop every subscription of a user, for users who blocked the bot
+async def unsubscribe_all(user_id: int) -> None:
+    def query(conn):
+        conn.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
+
+    await _write(query)
+
+
+# The notification run in progress, or a new one when products were added since
+# the last; None when there is nothing to announce
+async def start_notification_run() -> Optional[NotificationRun]:
+    def query(conn):
+        notified_id, run_up_to_id = conn.execute(
+            "SELECT notified_id, run_up_to_id FROM notification_cursor"
+        ).fetchone()
+        if run_up_to_id is None:
+            newest = conn.execute("SELECT COALESCE(MAX(id), 0) FROM items").fetchone()[0]
+            if newest <= notified_id:
+                return None
+            run_up_to_id = newest
+            conn.execute("UPDATE notification_cursor SET run_up_to_id = ?, user_cursor = 0", (run_up_to_id,))
+        return NotificationRun(notified_id, run_up_to_id)
+
+    return await _write(query)
+
+
+# Per category of the run's products still in the catalog: its id, name, count and first `listed` products
+async def new_items_by_category(run: NotificationRun, listed: int) -> List[CategoryNews]:
+    def query(conn):
+        rows = conn.execute(
+            """
+            SELECT categories.id, news.category, news.total, news.id, news.name, news.price
+            FROM (
+                SELECT id, name, price, category,
+                       ROW_NUMBER() OVER (PARTITION BY category ORDER BY id) AS position,
+                       COUNT(*) OVER (PARTITION BY category) AS total
+                FROM items WHERE id > ? AND id <= ?
+            ) AS news
+            JOIN categories ON categories.name = news.category
+            WHERE news.position <= ?
+            ORDER BY news.category, news.id
+            """,
+            (run.after_id, run.up_to_id, listed)
+        ).fetchall()
+        news = {}
+        for category_id, category, total, item_id, name, price in rows:
+            if category not in news:
+                news[category] = CategoryNews(category_id, category, total, [])
+            news[category].items.append((item_id, name, price))
+        return list(news.values())
+
+    return await _read(query)
+
+
+# Take the next `limit` subscribers of the run's categories as (user_id, [categories]),
+# moving the cursor past them in the same transaction so processes sharing the
+# database never take the same users. The run ends with the call that returns
+# fewer than `limit`; an empty list also means another process already ended it.
+async def claim_subscribers(run: NotificationRun, categories: List[str], limit: int) -> List[Tuple[int, List[str]]]:
+    def query(conn):
+        state = conn.execute("SELECT notified_id, run_up_to_id, user_cursor FROM notification_cursor").fetchone()
+        if state[:2] != tuple(run):
+            return []
+        rows = conn.execute(
+            """
+            SELECT user_id, json_group_array(category) FROM subscriptions
+            WHERE user_id > ? AND category IN (SELECT value FROM json_each(?))
+            GROUP BY user_id ORDER BY user_id LIMIT ?
+            """,
+            (state[2], json.dumps(categories), limit)
+        ).fetchall()
+        if len(rows) < limit:
+            conn.execute(
+                "UPDATE notification_cursor SET notified_id = run_up_to_id, run_up_to_id = NULL, user_cursor = 0"
+            )
+        else:
+            conn.execute("UPDATE notification_cursor SET user_cursor = ?", (rows[-1][0],))
+        return [(user_id, json.loads(names)) for user_id, names in rows]
+
+    return await _write(query)
+
+
+# Saved bot state of one kind as {key: JSON text}
+async def load_state(kind: str) -> Dict[str, str]:
+    def query(conn):
+        return dict(conn.execute("SELECT key, data FROM bot_state WHERE kind = ?", (kind,)))
+
+    return await _read(query)
+
+
+# Write a batch of {(kind, key): JSON text} in one transaction, None deletes the key
+async def save_state(changes: Dict[Tuple[str, str], Optional[str]]) -> None:
+    upserts = [(kind, key, data) for (kind, key), data in changes.items() if data is not None]
+    deletes = [(kind, key) for (kind, key), data in changes.items() if data is None]
+
+    def query(conn):
+        conn.executemany("INSERT OR REPLACE INTO bot_state (kind, key, data) VALUES (?, ?, ?)", upserts)
+        conn.executemany("DELETE FROM bot_state WHERE kind = ? AND key = ?", deletes)
+
+    await _write(query)
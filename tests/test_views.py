@@ -0,0 +1,96 @@
+import asyncio
+import html
+import os
+import sys
+from html.parser import HTMLParser
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import callbacks  # noqa: E402
+import catalog  # noqa: E402
+import storage  # noqa: E402
+import views  # noqa: E402
+
+NAME = "Tom's *Best* [Deluxe] snake_case <Tee> & co."
+CATEGORY = "Kids_Wear [*New*]"
+
+# The subset of HTML Telegram accepts in a message
+ALLOWED_TAGS = {'b', 'strong', 'i', 'em', 'u', 's', 'code', 'pre', 'a'}
+
+
+# Checks markup the way Telegram's entity parser does and collects the visible text
+class TelegramHTML(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.open = []
+        self.text = ''
+
+    def handle_starttag(self, tag, attrs):
+        assert tag in ALLOWED_TAGS, tag
+        self.open.append(tag)
+
+    def handle_endtag(self, tag):
+        assert self.open and self.open.pop() == tag, tag
+
+    def handle_data(self, data):
+        self.text += data
+
+
+def visible_text(screen):
+    assert screen.parse_mode == 'HTML'
+    parser = TelegramHTML()
+    parser.feed(screen.text)
+    parser.close()
+    assert not parser.open
+    return parser.text
+
+
+@pytest.fixture
+def catalog_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'DB_PATH', str(tmp_path / 'items.db'))
+    storage.init_db()
+    catalog.invalidate(categories=True)
+    try:
+        yield
+    finally:
+        storage.close_db()
+        catalog.invalidate(categories=True)
+
+
+def render_all():
+    async def run():
+        await catalog.add_category(CATEGORY)
+        await catalog.add_item(NAME, 12.5, CATEGORY)
+        category_id = await catalog.category_id(CATEGORY)
+        return [
+            await views.list_screen(),
+            await views.sort_screen(),
+            await views.category_screen(category_id),
+            await views.search_screen('snake'),
+            await views.price_screen(callbacks.PriceView('price', 0, category_id)),
+        ]
+
+    return asyncio.run(run())
+
+
+def test_names_with_markup_characters_render_verbatim(catalog_db):
+    screens = render_all()
+    for screen in screens:
+        text = visible_text(screen)
+        assert NAME in text
+        assert '\\' not in text
+        assert html.escape(NAME, quote=False) in screen.text
+    for screen in screens[2], screens[4]:
+        assert CATEGORY in visible_text(screen)
+
+
+def test_alerts_and_notifications_escape_category_names():
+    for subscribed in (True, False):
+        assert CATEGORY in visible_text(views.alerts_screen(1, CATEGORY, subscribed))
+    news = storage.CategoryNews(1, CATEGORY, 3, [(1, NAME, 12.5)])
+    text = visible_text(views.new_products_screen([news]))
+    assert CATEGORY in text
+    assert NAME in text
+    assert '2 more' in text
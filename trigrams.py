@@ -0,0 +1,87 @@
+import os
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Lowest similarity (1 - edit distance / length) a correction may have
+MIN_SIMILARITY = float(os.getenv("FUZZY_MIN_SIMILARITY", "0.6"))
+# Words sharing the most trigrams with the query word that get scored
+MAX_CANDIDATES = int(os.getenv("FUZZY_MAX_CANDIDATES", "64"))
+
+
+# Trigrams of a word padded like pg_trgm, so word starts weigh more and
+# three letter words still have a few
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+# Optimal string alignment distance: edits, where swapping two adjacent
+# letters ("iphnoe") counts as one
+def edit_distance(a, b):
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def similarity(a, b):
+    return 1 - edit_distance(a, b) / max(len(a), len(b), 1)
+
+
+# Short words and numbers have no useful near misses
+def indexable(word):
+    return len(word) >= 3 and not word.isdigit()
+
+
+# Inverted index from trigram to the words containing it. Only candidates
+# sharing trigrams with a query word are looked at, and of those only the
+# MAX_CANDIDATES with the most shared are scored by edit distance.
+class TrigramIndex:
+    def __init__(self, words: Iterable[str] = ()):
+        self._postings: Dict[str, Set[str]] = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if indexable(word):
+            for trigram in trigrams(word):
+                self._postings.setdefault(trigram, set()).add(word)
+
+    def remove(self, word):
+        for trigram in trigrams(word):
+            posting = self._postings.get(trigram)
+            if posting is not None:
+                posting.discard(word)
+                if not posting:
+                    del self._postings[trigram]
+
+    # (similarity, word) of indexed words close to word, best first
+    def matches(self, word, limit=5) -> List[Tuple[float, str]]:
+        if not indexable(word):
+            return []
+        shared = Counter()
+        for trigram in trigrams(word):
+            shared.update(self._postings.get(trigram, ()))
+
+        # A word this much longer or shorter cannot reach MIN_SIMILARITY
+        max_length_gap = int(len(word) * (1 - MIN_SIMILARITY) / MIN_SIMILARITY)
+        scored = []
+        for candidate, _ in shared.most_common(MAX_CANDIDATES):
+            if abs(len(candidate) - len(word)) > max_length_gap:
+                continue
+            score = similarity(word, candidate)
+            if score >= MIN_SIMILARITY:
+                scored.append((score, candidate))
+        scored.sort(key=lambda match: (-match[0], match[1]))
+        return scored[:limit]
+
+    def closest(self, word) -> Optional[str]:
+        found = self.matches(word, 1)
+        return found[0][1] if found else None
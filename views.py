@@ -0,0 +1,404 @@
+import html
+import os
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+
+import callbacks
+import catalog
+import prefixindex
+import storage
+
+MAX_RENDERED_VIEWS = int(os.getenv("VIEW_CACHE_SIZE", "1024"))
+# Telegram's limit on photos per album
+MAX_ALBUM_SIZE = 10
+
+# Cheapest products first across the whole catalog
+PRICE_BUTTON = callbacks.encode(callbacks.PRICE, *callbacks.PriceView('price', None, None).args())
+
+WELCOME_TEXT = """
+🛍️ *Welcome to Sami Shopping* 🛍️
+
+Browse products, compare prices, and find what you're looking for with ease!
+
+✨ *Features:*
+• 📋 Browse our complete product catalog
+• 🔍 Search for specific items
+• 🔠 Sort products alphabetically
+• 📂 Filter by category
+
+Use the menu below to start exploring! 👇
+    """
+
+WELCOME_BACK_TEXT = """
+🛍️ *Welcome to Sami Shopping* 🛍️
+
+Discover amazing products, compare prices, and find exactly what you're looking for with ease!
+
+✨ *Features:*
+• 📋 Browse our complete product catalog
+• 🔍 Search for specific items
+• 🔠 Sort products alphabetically
+• 📂 Filter by category
+
+Use the menu below to start exploring! 👇
+    """
+
+ADMIN_NOTE = "\n\n👑 *You have admin privileges!* Use /admin to access admin panel."
+
+EMPTY_CATALOG_TEXT = "📭 Our catalog is currently empty. Check back soon for new products!"
+
+
+# Screens showing product or category names are HTML: names may contain any
+# of Markdown's markup characters, and legacy Markdown has no escaping inside
+# a bold span
+def _escape(text):
+    return html.escape(text, quote=False)
+
+
+# Ready-to-send screen, markup_data is the keyboard already serialized for comparison
+class Screen(NamedTuple):
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup]
+    parse_mode: Optional[str]
+    markup_data: Optional[dict]
+
+
+def make_screen(text, keyboard=None, parse_mode=None):
+    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+    return Screen(text, reply_markup, parse_mode, reply_markup.to_dict() if reply_markup else None)
+
+
+# Rendered screens keyed by (view, page, role, catalog version).
+# Entries of older catalog versions are dropped as soon as the version moves.
+_rendered = OrderedDict()
+_rendered_version = None
+hits = 0
+misses = 0
+
+
+def render_cache_stats():
+    return {'hits': hits, 'misses': misses, 'size': len(_rendered)}
+
+
+async def _cached(view, page, role, render):
+    global _rendered_version, hits, misses
+    version = catalog.version
+    if version != _rendered_version:
+        _rendered.clear()
+        _rendered_version = version
+
+    key = (view, page, role, version)
+    screen = _rendered.get(key)
+    if screen is not None:
+        hits += 1
+        _rendered.move_to_end(key)
+        return screen
+
+    misses += 1
+    screen = await render()
+    # Don't keep a screen rendered from data a concurrent write just replaced
+    if catalog.version == version:
+        _rendered[key] = screen
+        if len(_rendered) > MAX_RENDERED_VIEWS:
+            _rendered.popitem(last=False)
+    return screen
+
+
+# Prev/Next keyboard rows for a page, see callbacks.parse_page
+def page_buttons(page, action, *suffix):
+    row = []
+    if page.has_prev:
+        row.append(InlineKeyboardButton(
+            "⬅️ Prev", callback_data=callbacks.encode(action, callbacks.PREV, page.items[0][0], *suffix)
+        ))
+    if page.has_next:
+        row.append(InlineKeyboardButton(
+            "Next ➡️", callback_data=callbacks.encode(action, callbacks.NEXT, page.items[-1][0], *suffix)
+        ))
+    return [row] if row else []
+
+
+# Main menu, `back` is the variant shown when returning from another screen
+async def welcome_screen(admin, back=False):
+    async def render():
+        welcome_text = WELCOME_BACK_TEXT if back else WELCOME_TEXT
+        if admin:
+            welcome_text += ADMIN_NOTE
+
+        keyboard = [
+            [InlineKeyboardButton("📋 Browse All Products", callback_data='list')],
+            [InlineKeyboardButton("🔍 Search Products", callback_data='search')],
+            [InlineKeyboardButton("🔠 Sort A-Z", callback_data='sort')],
+            [InlineKeyboardButton("💰 Sort by Price", callback_data=PRICE_BUTTON)],
+            [InlineKeyboardButton("📂 Filter by Category", callback_data='filter')]
+        ]
+        if admin:
+            keyboard.append([InlineKeyboardButton("👑 Admin Panel", callback_data='admin_panel')])
+        return make_screen(welcome_text, keyboard, 'Markdown')
+
+    return await _cached('welcome_back' if back else 'welcome', None, 'admin' if admin else 'customer', render)
+
+
+# All products in insertion order
+async def list_screen(after=None, before=None):
+    async def render():
+        page = await catalog.items_page('id', after=after, before=before)
+        if not page.items:
+            return make_screen(EMPTY_CATALOG_TEXT, [[InlineKeyboardButton("🏠 Back to Main Menu", callback_data='back_to_menu')]])
+
+        response = "📦 <b>All Products:</b>\n\n"
+        response += ''.join(
+            f"• <b>{_escape(item[1])}</b> - {item[2]:.2f} ETB ({_escape(item[3])})\n" for item in page.items
+        )
+        keyboard = page_buttons(page, callbacks.LIST_PAGE) + [
+            [InlineKeyboardButton("🔄 Sort A-Z", callback_data='sort')],
+            [InlineKeyboardButton("💰 Sort by Price", callback_data=PRICE_BUTTON)],
+            [InlineKeyboardButton("📂 Filter by Category", callback_data='filter')],
+            [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
+        ]
+        return make_screen(response, keyboard, 'HTML')
+
+    return await _cached('list', (after, before), None, render)
+
+
+# All products A-Z
+async def sort_screen(after=None, before=None):
+    async def render():
+        page = await catalog.items_page('name', after=after, before=before)
+        if not page.items:
+            return make_screen(EMPTY_CATALOG_TEXT, [[InlineKeyboardButton("🏠 Back to Main Menu", callback_data='back_to_menu')]])
+
+        response = "🔠 <b>Products Sorted A-Z:</b>\n\n"
+        response += ''.join(
+            f"• <b>{_escape(item[1])}</b> - {item[2]:.2f} ETB ({_escape(item[3])})\n" for item in page.items
+        )
+        keyboard = page_buttons(page, callbacks.SORT_PAGE) + [
+            [InlineKeyboardButton("📋 View All Products", callback_data='list')],
+            [InlineKeyboardButton("💰 Sort by Price", callback_data=PRICE_BUTTON)],
+            [InlineKeyboardButton("📂 Filter by Category", callback_data='filter')],
+            [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
+        ]
+        return make_screen(response, keyboard, 'HTML')
+
+    return await _cached('sort', (after, before), None, render)
+
+
+# Category picker for browsing
+async def categories_screen():
+    async def render():
+        categories = await catalog.get_category_rows()
+        if not categories:
+            return make_screen(
+                "📭 No categories available yet. Check back soon!",
+                [[InlineKeyboardButton("🏠 Back to Main Menu", callback_data='back_to_menu')]]
+            )
+
+        keyboard = [
+            [InlineKeyboardButton(f"📂 {name}", callback_data=callbacks.encode(callbacks.CATEGORY, category_id))]
+            for category_id, name in categories
+        ]
+        keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')])
+        return make_screen("📂 *Select a category:*", keyboard, 'Markdown')
+
+    return await _cached('categories', None, None, render)
+
+
+# Products of one category A-Z
+async def category_screen(category_id, after=None, before=None):
+    async def render():
+        back_rows = [
+            [InlineKeyboardButton("📂 Back to Categories", callback_data='back_to_categories')],
+            [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
+        ]
+        category = await catalog.category_name(category_id)
+        if category is None:
+            return make_screen("📭 This category no longer exists.", back_rows)
+
+        page = await catalog.items_page('name', category=category, after=after, before=before)
+        if not page.items:
+            return make_screen(f"📭 No products found in '{category}' category. Check back soon!", back_rows)
+
+        response = f"📂 <b>Products in {_escape(category)}:</b>\n\n"
+        response += ''.join(f"• <b>{_escape(item[1])}</b> - {item[2]:.2f} ETB\n" for item in page.items)
+        by_price = callbacks.PriceView('price', None, category_id)
+        keyboard = page_buttons(page, callbacks.CATEGORY_PAGE, category_id)
+        photos = await storage.get_photos([item[0] for item in page.items])
+        if photos:
+            # Drawn with this page's own anchor, so the handler fetches the same page
+            direction, anchor = (callbacks.PREV, before) if before is not None else (callbacks.NEXT, after or 0)
+            keyboard.append([InlineKeyboardButton(
+                f"🖼 Photos ({len(photos)})", callback_data=callbacks.encode(callbacks.PHOTOS, direction, anchor, category_id)
+            )])
+        keyboard += [
+            [InlineKeyboardButton("💰 Sort by Price", callback_data=callbacks.encode(callbacks.PRICE, *by_price.args()))],
+            [InlineKeyboardButton("🔔 New Product Alerts", callback_data=callbacks.encode(callbacks.ALERTS, category_id))],
+        ] + back_rows
+        return make_screen(response, keyboard, 'HTML')
+
+    return await _cached('category', (category_id, after, before), None, render)
+
+
+# One page of ranked search results
+async def search_screen(search_term, offset=0):
+    async def render():
+        page = await storage.search_items(search_term, offset)
+        response = f"🔍 <b>Search results for '{_escape(search_term)}':</b>\n\n"
+
+        # Nothing matches as typed, show the results for the typo-corrected query instead
+        if not page.items:
+            suggestion = await prefixindex.suggest(search_term)
+            if suggestion is not None:
+                page = await storage.search_items(suggestion, offset)
+                response = (
+                    f"🔍 No products found matching '{_escape(search_term)}'. "
+                    f"Did you mean <b>{_escape(suggestion)}</b>?\n\n"
+                )
+
+        if not page.items:
+            return make_screen(
+                f"🔍 No products found matching '{search_term}'. Try different keywords or browse our full catalog!",
+                [[InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]]
+            )
+
+        response += ''.join(
+            f"• <b>{_escape(item[1])}</b> - {item[2]:.2f} ETB ({_escape(item[3])})\n" for item in page.items
+        )
+
+        nav = []
+        if page.has_prev:
+            nav.append(InlineKeyboardButton(
+                "⬅️ Prev", callback_data=callbacks.encode(callbacks.SEARCH_PAGE, max(offset - storage.PAGE_SIZE, 0))
+            ))
+        if page.has_next:
+            nav.append(InlineKeyboardButton(
+                "Next ➡️", callback_data=callbacks.encode(callbacks.SEARCH_PAGE, offset + storage.PAGE_SIZE)
+            ))
+
+        keyboard = [nav] if nav else []
+        keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')])
+        return make_screen(response, keyboard, 'HTML')
+
+    return await _cached('search', (search_term, offset), None, render)
+
+
+def price_range_label(bucket):
+    low, high = storage.PRICE_BUCKETS[bucket]
+    if low is None:
+        return f"Under {high:,g} ETB"
+    if high is None:
+        return f"{low:,g}+ ETB"
+    return f"{low:,g}–{high:,g} ETB"
+
+
+# Products by price, cheapest or dearest first, optionally within a price range and a category
+async def price_screen(view, after=None, before=None):
+    async def render():
+        bucket = view.bucket if view.bucket is not None and view.bucket < len(storage.PRICE_BUCKETS) else None
+        menu_row = [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')]
+        category = None
+        if view.category_id is not None:
+            category = await catalog.category_name(view.category_id)
+            if category is None:
+                return make_screen("📭 This category no longer exists.", [menu_row])
+
+        min_price, max_price = storage.PRICE_BUCKETS[bucket] if bucket is not None else (None, None)
+        page = await catalog.items_page(
+            view.order, category=category, after=after, before=before, min_price=min_price, max_price=max_price
+        )
+
+        def button(label, **changes):
+            return InlineKeyboardButton(
+                label, callback_data=callbacks.encode(callbacks.PRICE, *view._replace(**changes).args())
+            )
+
+        descending = view.order == 'price_desc'
+        title = f"Products by Price ({'High to Low' if descending else 'Low to High'})"
+        if category is not None:
+            title += f" in {_escape(category)}"
+        response = f"💰 <b>{title}</b>"
+        if bucket is not None:
+            response += f"\n<i>{price_range_label(bucket)}</i>"
+        response += "\n\n"
+        if page.items:
+            response += ''.join(
+                f"• <b>{_escape(item[1])}</b> - {item[2]:.2f} ETB ({_escape(item[3])})\n" for item in page.items
+            )
+        else:
+            response += "📭 No products in this price range."
+
+        keyboard = page_buttons(page, callbacks.PRICE_PAGE, *view.args())
+        keyboard.append([
+            button("⬆️ Low to High", order='price') if descending else button("⬇️ High to Low", order='price_desc')
+        ])
+        keyboard.append([
+            button(("✅ " if index == bucket else "") + price_range_label(index), bucket=index)
+            for index in range(len(storage.PRICE_BUCKETS))
+        ])
+        if bucket is not None:
+            keyboard.append([button("💲 All Prices", bucket=None)])
+        if category is not None:
+            keyboard.append([InlineKeyboardButton(
+                f"📂 Back to {category}", callback_data=callbacks.encode(callbacks.CATEGORY, view.category_id)
+            )])
+        keyboard.append(menu_row)
+        return make_screen(response, keyboard, 'HTML')
+
+    return await _cached('price', (view, after, before), None, render)
+
+
+# A user's alert setting for one category, not cached as it differs per user
+def alerts_screen(category_id, category, subscribed):
+    name = _escape(category)
+    if subscribed:
+        text = f"🔔 <b>Alerts for {name} are on.</b>\n\nYou get a message when new products arrive in this category."
+        toggle = InlineKeyboardButton("🔕 Turn Off", callback_data=callbacks.encode(callbacks.SET_ALERTS, category_id, 0))
+    else:
+        text = f"🔕 <b>Alerts for {name} are off.</b>\n\nTurn them on to get a message when new products arrive in this category."
+        toggle = InlineKeyboardButton("🔔 Turn On", callback_data=callbacks.encode(callbacks.SET_ALERTS, category_id, 1))
+    return make_screen(text, [
+        [toggle],
+        [InlineKeyboardButton(f"📂 Back to {category}", callback_data=callbacks.encode(callbacks.CATEGORY, category_id))],
+        [InlineKeyboardButton("🏠 Main Menu", callback_data='back_to_menu')],
+    ], 'HTML')
+
+
+# One notification about the products added to the given storage.CategoryNews
+def new_products_screen(news):
+    response = "🔔 <b>New products!</b>\n"
+    keyboard = []
+    for category in news:
+        response += f"\n📂 <b>{_escape(category.category)}</b>\n"
+        response += ''.join(f"• {_escape(name)} - {price:.2f} ETB\n" for _, name, price in category.items)
+        if category.count > len(category.items):
+            response += f"<i>...and {category.count - len(category.items)} more</i>\n"
+        keyboard.append([InlineKeyboardButton(
+            f"📂 {category.category}", callback_data=callbacks.encode(callbacks.CATEGORY, category.category_id)
+        )])
+    return make_screen(response, keyboard, 'HTML')
+
+
+# Albums of the products among items that have a photo in photos, sent by file_id
+def photo_albums(items, photos) -> List[List[InputMediaPhoto]]:
+    media = [
+        InputMediaPhoto(photos[item_id], caption=f"{name} - {price:.2f} ETB")
+        for item_id, name, price, *_ in items if item_id in photos
+    ]
+    return [media[index:index + MAX_ALBUM_SIZE] for index in range(0, len(media), MAX_ALBUM_SIZE)]
+
+
+# Render the screens most sessions open with, so the first users after a start
+# don't each pay for the queries: the menu, the first page of every listing
+# and the category list with each category's first page
+async def warm_up():
+    for admin in (False, True):
+        for back in (False, True):
+            await welcome_screen(admin, back)
+    await list_screen()
+    await sort_screen()
+    await price_screen(callbacks.PriceView('price', None, None))
+    await price_screen(callbacks.PriceView('price_desc', None, None))
+    await categories_screen()
+    for category_id, _ in await catalog.get_category_rows():
+        await category_screen(category_id)
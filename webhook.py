@@ -0,0 +1,101 @@
+import asyncio
+import hmac
+import json
+import os
+import signal
+
+from telegram import Update
+
+from httpserver import Response, json_response, start_server
+
+# Public HTTPS URL Telegram should post to. Left empty the webhook is not
+# registered, which is how it's tested locally by POSTing updates by hand.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+
+# Routes for the webhook listener: the update endpoint and a health check.
+# The endpoint also takes a JSON array of updates, which is how workers.py forwards them.
+def webhook_routes(app, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH):
+    # None unless data is an update object; de_json fails on other JSON with AttributeError
+    def parse(data):
+        if not isinstance(data, dict):
+            return None
+        try:
+            return Update.de_json(data, app.bot)
+        except (AttributeError, ValueError, TypeError, KeyError):
+            return None
+
+    async def receive_update(request):
+        if secret:
+            token = request.headers.get('x-telegram-bot-api-secret-token', '')
+            if not hmac.compare_digest(token, secret):
+                return Response(403)
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(400)
+
+        updates = [parse(item) for item in data] if isinstance(data, list) else [parse(data)]
+        if not updates or None in updates:
+            return Response(400)
+        for update in updates:
+            await app.update_queue.put(update)
+        return Response(200)
+
+    async def health(request):
+        status = 200 if app.running else 503
+        return json_response(status, {
+            'status': 'ok' if app.running else 'stopped',
+            'update_queue': app.update_queue.qsize(),
+        })
+
+    return {
+        ('POST', path): receive_update,
+        ('GET', '/health'): health,
+    }
+
+
+# Serve updates from a local HTTP listener until one of stop_signals. Workers
+# (see workers.py) use it with their own port and secret and no public URL.
+async def serve_webhook(app, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, url=WEBHOOK_URL, secret=WEBHOOK_SECRET,
+                        stop_signals=(signal.SIGINT, signal.SIGTERM)):
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+
+    if url:
+        await app.bot.set_webhook(
+            url.rstrip('/') + WEBHOOK_PATH,
+            secret_token=secret or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+
+    server = await start_server(listen, port, webhook_routes(app, secret), max_connections=WEBHOOK_MAX_CONNECTIONS)
+    await app.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in stop_signals:
+        loop.add_signal_handler(signum, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_webhook(app):
+    asyncio.run(serve_webhook(app))
@@ -0,0 +1,319 @@
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import zlib
+
+import httpx
+from telegram import Update
+
+import catalog
+import metrics
+import ratelimit
+import startup
+import storage
+from httpserver import Response, json_response, start_server
+from processor import SERIALIZE_BY
+from webhook import WEBHOOK_LISTEN, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL, serve_webhook
+
+# Scale-out mode. One dispatcher process takes updates from Telegram, by long
+# polling or on the webhook, and forwards each to one of WORKER_PROCESSES
+# worker processes picked by hashing the user id (the chat id with
+# UPDATE_SERIALIZE_BY=chat), the same key PerUserUpdateProcessor serializes on.
+# A user's updates therefore always reach the same worker, in order, and their
+# conversation state and user_data stay with it. Each worker is a complete bot
+# receiving on a local webhook port; all of them share items.db through WAL
+# and poll the catalog version so caches drop changes made by other workers.
+
+# Number of worker processes, 0 runs the bot in a single process
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+# Worker i listens on 127.0.0.1 at WORKER_BASE_PORT + i
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8600"))
+# Seconds between checks for catalog changes made by other workers
+CATALOG_SYNC_INTERVAL = float(os.getenv("CATALOG_SYNC_INTERVAL", "0.5"))
+# Long polling timeout of the dispatcher's getUpdates calls
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))
+# Most updates forwarded to a worker in one request
+FORWARD_BATCH_SIZE = int(os.getenv("FORWARD_BATCH_SIZE", "100"))
+# Seconds the dispatcher waits on shutdown for workers to take queued updates
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+# User or chat id an update is serialized on, mirrors PerUserUpdateProcessor._key
+# but reads the raw JSON so the dispatcher never builds Update objects
+def shard_key(data, serialize_by=SERIALIZE_BY):
+    for field, payload in data.items():
+        if field == 'update_id' or not isinstance(payload, dict):
+            continue
+        user = payload.get('from') or payload.get('user')
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if serialize_by == 'chat' and chat:
+            return chat['id']
+        if user:
+            return user['id']
+        if chat:
+            return chat['id']
+    return None
+
+
+def shard(data, count):
+    key = shard_key(data)
+    if key is None:
+        return 0
+    return zlib.crc32(str(key).encode()) % count
+
+
+async def _watch_catalog():
+    while True:
+        await asyncio.sleep(CATALOG_SYNC_INTERVAL)
+        await catalog.sync()
+
+
+async def _serve_worker(app, port, secret):
+    watch = None
+    post_init = app.post_init
+    post_stop = app.post_stop
+
+    async def start_watch(app):
+        nonlocal watch
+        if post_init:
+            await post_init(app)
+        watch = asyncio.create_task(_watch_catalog())
+
+    # Stopped before post_shutdown closes the database
+    async def stop_watch(app):
+        if watch is not None:
+            watch.cancel()
+        if post_stop:
+            await post_stop(app)
+
+    app.post_init = start_watch
+    app.post_stop = stop_watch
+    await serve_webhook(app, '127.0.0.1', port, url='', secret=secret, stop_signals=(signal.SIGTERM,))
+
+
+# Each worker's even share of the overall message rate, at least one message per
+# second: a smaller share would make the bot crawl, see the warning in Dispatcher
+def worker_rate(count):
+    return max(ratelimit.GLOBAL_RATE / count, 1)
+
+
+# Entry point of a worker process, build_app(global_rate) returns the configured Application.
+# Workers split the overall message rate evenly; per-chat limits stay exact as a chat never moves.
+def _worker_main(build_app, index, count, port, secret):
+    # Ctrl+C reaches every process of the group; the dispatcher stops the workers once drained
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += 1 + index
+    # Spawned processes start without the dispatcher's logging setup
+    logging.basicConfig(format=f'%(asctime)s worker {index} %(name)s %(levelname)s %(message)s', level=logging.INFO)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    storage.init_db()
+    startup.mark('database')
+    app = build_app(worker_rate(count))
+    startup.mark('build')
+    asyncio.run(_serve_worker(app, port, secret))
+
+
+class _Worker:
+    def __init__(self, index):
+        self.index = index
+        self.port = WORKER_BASE_PORT + index
+        self.process = None
+        self.queue = asyncio.Queue()
+
+
+# Forward a worker's queue in order, one batch at a time; waits out a worker restart
+async def _forward(worker, client, secret):
+    url = f'http://127.0.0.1:{worker.port}{WEBHOOK_PATH}'
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret, 'Content-Type': 'application/json'}
+    while True:
+        batch = [await worker.queue.get()]
+        while len(batch) < FORWARD_BATCH_SIZE and not worker.queue.empty():
+            batch.append(worker.queue.get_nowait())
+        body = json.dumps(batch).encode()
+
+        delay = 0.05
+        while True:
+            try:
+                response = await client.post(url, content=body, headers=headers)
+            except httpx.HTTPError:
+                response = None
+            if response is not None and response.status_code < 500:
+                if response.status_code != 200:
+                    logger.error("worker %d rejected %d updates: HTTP %d", worker.index, len(batch), response.status_code)
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 2)
+
+        for _ in batch:
+            worker.queue.task_done()
+
+
+class Dispatcher:
+    def __init__(self, build_app, token, api_url, mode, count=WORKER_PROCESSES):
+        self.build_app = build_app
+        self.api_url = f'{api_url}{token}'
+        self.mode = mode
+        self.workers = [_Worker(index) for index in range(count)]
+        if ratelimit.GLOBAL_RATE / count < 1:
+            logger.warning(
+                "OUTBOUND_GLOBAL_RATE %g is less than one message/s per worker, the %d workers send up to %g/s together",
+                ratelimit.GLOBAL_RATE, count, worker_rate(count) * count
+            )
+        # Only the dispatcher posts to the workers
+        self.secret = secrets.token_urlsafe(32)
+        self.client = None
+        self._context = multiprocessing.get_context('spawn')
+
+    def _start_worker(self, worker):
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(self.build_app, worker.index, len(self.workers), worker.port, self.secret),
+            name=f'bot-worker-{worker.index}',
+        )
+        worker.process.start()
+
+    def dispatch(self, data):
+        worker = self.workers[shard(data, len(self.workers))]
+        worker.queue.put_nowait(data)
+
+    # Restart workers that died, on the same port so their users stay put
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(1)
+            for worker in self.workers:
+                if not worker.process.is_alive():
+                    logger.error("worker %d exited with code %s, restarting", worker.index, worker.process.exitcode)
+                    self._start_worker(worker)
+
+    async def _call(self, method, **params):
+        response = await self.client.post(
+            f'{self.api_url}/{method}', data=params, timeout=POLL_TIMEOUT + 10
+        )
+        result = response.json()
+        if not result.get('ok'):
+            raise RuntimeError(f"{method} failed: {result.get('description')}")
+        return result['result']
+
+    async def _poll(self):
+        await self._call('deleteWebhook')
+        offset = 0
+        try:
+            while True:
+                try:
+                    updates = await self._call(
+                        'getUpdates', offset=offset, timeout=POLL_TIMEOUT, allowed_updates=json.dumps(Update.ALL_TYPES)
+                    )
+                except (httpx.HTTPError, ValueError, RuntimeError) as error:
+                    logger.warning("getUpdates failed: %s", error)
+                    await asyncio.sleep(1)
+                    continue
+                for data in updates:
+                    self.dispatch(data)
+                    offset = data['update_id'] + 1
+        finally:
+            self._offset = offset
+
+    async def _serve_webhook(self):
+        async def receive_update(request):
+            if WEBHOOK_SECRET:
+                token = request.headers.get('x-telegram-bot-api-secret-token', '')
+                if not hmac.compare_digest(token, WEBHOOK_SECRET):
+                    return Response(403)
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                return Response(400)
+            if not isinstance(data, dict) or 'update_id' not in data:
+                return Response(400)
+            self.dispatch(data)
+            return Response(200)
+
+        async def health(request):
+            alive = sum(worker.process.is_alive() for worker in self.workers)
+            return json_response(200 if alive == len(self.workers) else 503, {
+                'workers': len(self.workers),
+                'alive': alive,
+                'queued': [worker.queue.qsize() for worker in self.workers],
+            })
+
+        if WEBHOOK_URL:
+            await self._call(
+                'setWebhook',
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=json.dumps(Update.ALL_TYPES),
+            )
+        return await start_server(
+            WEBHOOK_LISTEN, WEBHOOK_PORT,
+            {('POST', WEBHOOK_PATH): receive_update, ('GET', '/health'): health},
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+
+    async def serve(self):
+        # Migrate once here rather than racing in every worker
+        storage.init_db()
+        storage.close_db()
+        for worker in self.workers:
+            self._start_worker(worker)
+
+        self.client = httpx.AsyncClient(timeout=10)
+        senders = [asyncio.create_task(_forward(worker, self.client, self.secret)) for worker in self.workers]
+        supervisor = asyncio.create_task(self._supervise())
+        self._offset = None
+        poller = server = None
+        if self.mode == 'webhook':
+            server = await self._serve_webhook()
+        else:
+            poller = asyncio.create_task(self._poll())
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        try:
+            await stop.wait()
+        finally:
+            if poller is not None:
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+
+            # Hand every received update to its worker before stopping them
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(worker.queue.join() for worker in self.workers)), DRAIN_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.error("%d updates not forwarded", sum(worker.queue.qsize() for worker in self.workers))
+            supervisor.cancel()
+            for sender in senders:
+                sender.cancel()
+            await asyncio.gather(supervisor, *senders, return_exceptions=True)
+
+            # Confirm the forwarded updates so Telegram doesn't send them again
+            if self._offset:
+                try:
+                    await self._call('getUpdates', offset=self._offset, timeout=0)
+                except (httpx.HTTPError, ValueError, RuntimeError):
+                    pass
+            await self.client.aclose()
+
+            for worker in self.workers:
+                worker.process.terminate()
+            await loop.run_in_executor(None, lambda: [worker.process.join() for worker in self.workers])
+
+
+def run_workers(build_app, token, api_url, mode):
+    asyncio.run(Dispatcher(build_app, token, api_url, mode).serve())